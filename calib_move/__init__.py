@@ -1,7 +1,11 @@
 from .core.jsontemplate import main_generate_json
+from .core.streaming import main_stream
+from .core.watching import main_watch
 from .main import main_func
 
 __all__ = [
     "main_func",
     "main_generate_json",
+    "main_stream",
+    "main_watch",
 ]
\ No newline at end of file
@@ -5,7 +5,8 @@ import cv2 as cv
 import numpy as np
 from numpy.typing import NDArray
 
-from ..util.imgblending import calc_kde_image, calc_median_image, calc_mode_image
+from ..util.framesource import FrameSource, OpenCVFrameSource, PyAVFrameSource
+from ..util.imgblending import BlendingAccumulator, KDEAccumulator, MedianAccumulator, ModeAccumulator
 
 # handling file paths thorughout the module
 ROOT = Path(__file__).resolve().parents[2]
@@ -28,29 +29,101 @@ class KeypointMatcher(Enum):
     BF_NORM_L2   = { # good for SIFT, SURF
         "callable": cv.BFMatcher, 
         "args": (cv.NORM_L2, ),      
-        "kwargs": {"crossCheck": True}
+        "kwargs": {"crossCheck": True},
+        "index": False,
     } 
     BF_NORM_HAMM = { # good for binary desc ORB, AKAZE, BRISK
         "callable": cv.BFMatcher, 
         "args": (cv.NORM_HAMMING, ), 
-        "kwargs": {"crossCheck": True}
+        "kwargs": {"crossCheck": True},
+        "index": False,
     } 
+    FLANN_KDTREE = { # approximate, for float desc SIFT, SURF (randomized kd-trees)
+        "callable": cv.FlannBasedMatcher,
+        "args": (dict(algorithm=1, trees=5), dict(checks=50)), # algorithm 1 = FLANN_INDEX_KDTREE
+        "kwargs": {},
+        "index": True,
+    }
+    FLANN_LSH = { # approximate, for binary desc ORB, AKAZE, BRISK (locality sensitive hashing)
+        "callable": cv.FlannBasedMatcher,
+        "args": (dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1), dict(checks=50)), # 6 = LSH
+        "kwargs": {},
+        "index": True,
+    }
     
-    def instantiate(self):
+    @property
+    def uses_index(self) -> bool:
+        # whether the static frame descriptors are trained into a search index once (instead of passed on every call)
+        return self.value["index"]
+    
+    def instantiate(self, ratio_test: bool = False):
         factory = self.value["callable"]
         args    = self.value["args"]
         kwargs  = self.value["kwargs"]
         
+        # cross checking only works with single nearest neighbour matching (not with kNN for the ratio test)
+        if ratio_test is True:
+            kwargs = {ky: vl for ky, vl in kwargs.items() if ky != "crossCheck"}
+        
         return factory(*args, **kwargs)
         
 # all supported methods for blending multiple images to remove moving elements  
 class InitFrameBlending(Enum):
-    MEDIAN = {"callable": calc_median_image} # naive, only works if the image is mostly static with a moving objs
-    MODE   = {"callable": calc_mode_image} # work well even when moving objs > 50% of the time, but has artefacts
-    KDE    = {"callable": calc_kde_image} # most robust but computationally intensive
+    MEDIAN = {"accumulator": MedianAccumulator} # naive, only works if the image is mostly static with a moving objs
+    MODE   = {"accumulator": ModeAccumulator} # work well even when moving objs > 50% of the time, but has artefacts
+    KDE    = {"accumulator": KDEAccumulator} # most robust but computationally intensive
+    
+    def accumulator(
+        self, 
+        native_res: bool = False, 
+        threads: int = 1, 
+        shape: tuple[int, int] | None = None,
+        n_frames: int | None = None,
+    ) -> BlendingAccumulator:
+        """ streaming blender: frames are fed one by one with .add(frame) and combined with .result(). With the shape of the original frames, the frames can be fed at .frame_scale. With the number of frames, the memory is planned for exactly this many frames (otherwise for the worst case). """
+        # the kde works on a reduced resolution, median and mode run at native resolution as long as the memory budget allows
+        if self is InitFrameBlending.KDE:
+            return KDEAccumulator(
+                native_res=native_res, mem_budget_mb=BLEND_MEM_BUDGET_MB, threads=threads, shape=shape, n_frames=n_frames
+            )
+        return self.value["accumulator"](mem_budget_mb=BLEND_MEM_BUDGET_MB, threads=threads, shape=shape, n_frames=n_frames)
+    
+    def __call__(self, img_list: list[NDArray], native_res: bool = False, threads: int = 1) -> NDArray[np.uint8]:
+        accumulator = self.accumulator(native_res=native_res, threads=threads, n_frames=len(img_list))
+        for img in img_list:
+            accumulator.add(img)
+        return accumulator.result()
+
+# all supported backends for rendering the motion plots
+class PlotBackend(Enum):
+    PLOTLY = "plotly" # plotly figure rendered by kaleido (nicest fonts, but slow: one browser round trip per video)
+    RASTER = "raster" # drawn directly with cv2 (fast, same plot elements with the simpler cv2 font)
+
+# all supported ways of writing the plots of a batch of videos
+class OutputMode(Enum):
+    STITCHED  = "stitched" # one tall image with the plots of all videos (all plots are held in memory until the end)
+    PAGED     = "paged" # one image per page of videos, written as soon as the page is complete (plus html index)
+    PER_VIDEO = "per_video" # one image per video, written as soon as the video is done (plus html index)
+
+# all supported video decoding backends
+class DecodeBackend(Enum):
+    OPENCV = {"source": OpenCVFrameSource} # cv2.VideoCapture (no extra dependency)
+    PYAV   = {"source": PyAVFrameSource} # libav through PyAV (multi-threaded decoding, exact seeking by timestamp), needs PyAV
     
-    def __call__(self, img_list: list[NDArray]) -> NDArray[np.uint8]:
-        return self.value["callable"](img_list)
+    def open(self, path: Path, threads: int = 0, luma_only: bool = False) -> FrameSource:
+        return self.value["source"](path, threads=threads, luma_only=luma_only)
+    
+    def available(self) -> bool:
+        return self.value["source"].available()
+
+# all supported formats for exporting the numeric results
+class ExportFormat(Enum):
+    NPZ  = "npz" # compressed numpy arrays (columnar), fastest to load back
+    CSV  = "csv" # one row per main step
+    JSON = "json" # columnar, NaN as null
+
+# memory budget of the frame blending: half for the buffered frames or the per pixel histogram, half for the temporary arrays when finalizing (in tiles). frames that do not fit are blended at a lower resolution
+BLEND_MEM_BUDGET_MB = 512
         
 
 # minimum number of keypoint matches between two images so that homography estimation is attempted
@@ -59,12 +132,24 @@ MIN_MATCHES_HO = 20
 # ransac threshold for homography estimation
 RANSAC_REPROJ_THRESH_HO = 5
 
+# with automatic processing scale, frames are downscaled so that their longer side is at most this many px
+PROC_AUTO_MAX_SIDE = 1280
+
 # number of subframes around each main step
 N_SUBFR = 5 
 
 # length in s of the interval (in which the subframes are evenly distributed)
 T_SUBFR = 3 
 
+# estimated cost of one seek in the video (in number of frames that could be skipped with grab() instead). when reading the frames in one forward pass, only gaps larger than this are seeked. roughly half a typical GOP.
+SEEK_COST_FRAMES = 60
+
+# maximum distance in s by which main and sub-frame indices are moved to the nearest keyframe (when snapping is enabled)
+KEYFRAME_SNAP_TOL = 0.5
+
+# number of grid cells per image side for the keypoint budget (keypoints are selected evenly from KP_GRID x KP_GRID cells)
+KP_GRID = 8
+
 # point-grid resolution for evaluating homographies
 HO_GRID_RES = 20
 
@@ -73,3 +158,18 @@ BW_MAIN_MODE = 2.0
 
 # any motion estimate with confidence lower than this will be considered an error (between [0, 1])
 AGREEMENT_THRESH = 0.30
+
+# with --early-agreement, the sub-frames of a main step are no longer evaluated once the first ones agree at least this well (agreement of main_mode_kde, between [0, 1])
+EARLY_AGREEMENT_THRESH = 0.90
+
+# size limit of the on-disk reference frame cache (least recently used entries are evicted beyond this)
+REF_CACHE_MAX_MB = 512
+
+# longer side in px of the downscaled reference frame that is kept with the results (background of the --heatmap image)
+REFERENCE_THUMB_MAX_SIDE = 1000
+
+# layout of the entries of the on-disk result store (--incremental). bump on every change, so that the changed spec invalidates the old entries
+RESULT_STORE_FORMAT = 3
+
+# number of internal cv2 threads per worker process in batch mode (otherwise n_workers * n_cores threads compete)
+CV_THREADS_PER_WORKER = 1
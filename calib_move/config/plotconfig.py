@@ -41,6 +41,10 @@ class PlotConfig:
     N_TIX_X = 7
     N_TIX_Y = 4
     
+    # inlier heatmap -----------------------------------------------------------
+    HEATMAP_SIGMA = 0.015 # gaussian smoothing of the inlier density, relative to the longer side
+    HEATMAP_ALPHA = 0.70 # opacity of the density overlay at the highest density
+    
 
 
     
@@ -0,0 +1,109 @@
+import os
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2 as cv
+import numpy as np
+
+from ..config.coreconfig import CV_THREADS_PER_WORKER
+from ..util.util import pbar
+from .caching import ResultStore
+from .containers import CLIArgs, VideoContainer
+from .processing import process_video, processing_spec
+
+# folder (inside the output path) in which the per-video results are stored for incremental reruns
+RESULT_STORE_DIR = ".calib_move_results"
+
+
+def init_worker() -> None:
+    # limit cv2 internal threading, the parallelism comes from the worker processes themselves
+    cv.setNumThreads(CV_THREADS_PER_WORKER)
+    # nested progress bars of multiple processes would just garble the terminal (tqdm reads TQDM_* env defaults)
+    os.environ["TQDM_DISABLE"] = "1"
+
+def process_video_worker(CLIARGS: CLIArgs, video: VideoContainer) -> VideoContainer:
+    # runs in a separate process: the container is a pickled copy, so it has to be sent back to be merged
+    process_video(CLIARGS, video)
+    return video
+
+def merge_results(video: VideoContainer, done: VideoContainer) -> None:
+    # copies the results of a processed container (pickled copy from a worker process) into the original one
+    video.timestamps = done.timestamps
+    video.movements  = done.movements
+    video.agreements = done.agreements
+    video.errors     = done.errors
+    video.subframes  = done.subframes
+    video.detections = done.detections
+    video.reference  = done.reference
+    video.profile    = done.profile
+
+def store_results(store: ResultStore | None, CLIARGS: CLIArgs, video: VideoContainer) -> None:
+    if store is None:
+        return
+    store.store(processing_spec(CLIARGS, video), video.path, {
+        "timestamps": np.array(video.timestamps, dtype=np.float64),
+        "movements": np.array(video.movements, dtype=np.float64),
+        "agreements": np.array(video.agreements, dtype=np.float64),
+        "errors": np.array(video.errors, dtype=bool),
+        "subframes": np.array(video.subframes, dtype=np.int64),
+        "detections": np.asarray(video.detections, dtype=np.float32).reshape(-1, 3),
+        "reference": video.reference,
+    })
+
+def load_results(store: ResultStore | None, CLIARGS: CLIArgs, video: VideoContainer) -> bool:
+    if store is None:
+        return False
+    results = store.load(processing_spec(CLIARGS, video), video.path)
+    if results is None:
+        return False
+    video.timestamps = list(results["timestamps"])
+    video.movements = list(results["movements"])
+    video.agreements = list(results["agreements"])
+    video.errors = [bool(er) for er in results["errors"]]
+    video.subframes = [int(sf) for sf in results["subframes"]]
+    video.detections = results["detections"]
+    video.reference = results["reference"]
+    return True
+
+def process_videos(
+    CLIARGS: CLIArgs, 
+    videos: list[VideoContainer], 
+    on_done: Callable[[VideoContainer], None] | None = None,
+) -> None:
+    """ processes all videos (serially or in a process pool). on_done is called with every video as soon as its results are available (in order of completion). """
+    
+    on_done = on_done if on_done is not None else (lambda vd: None)
+    
+    # incremental mode: only process videos which are new or whose inputs or parameters changed ------------------------
+    store = ResultStore(CLIARGS.output_path/RESULT_STORE_DIR) if CLIARGS.incremental is True else None
+    todo = []
+    for vd in videos:
+        if load_results(store, CLIARGS, vd) is True:
+            on_done(vd)
+        else:
+            todo.append(vd)
+    videos = todo
+    if store is not None:
+        print(f"incremental: {len(videos)} new or changed video(s) to process")
+
+    # serial mode (in main process) ------------------------------------------------------------------------------------
+    if CLIARGS.workers <= 1 or len(videos) <= 1:
+        for vd in pbar(videos, desc="processing video(s)", position=0, leave=True):
+            process_video(CLIARGS, vd) # stores calculate average movement directly in VideoContainer
+            store_results(store, CLIARGS, vd)
+            on_done(vd)
+        return
+
+    # batch mode (process pool) ----------------------------------------------------------------------------------------
+    # longest videos are submitted first, so that no single long video is started last and stalls the whole batch
+    order = sorted(range(len(videos)), key=lambda i: videos[i].ftot, reverse=True)
+
+    with ProcessPoolExecutor(max_workers=min(CLIARGS.workers, len(videos)), initializer=init_worker) as pool:
+        futures = {pool.submit(process_video_worker, CLIARGS, videos[i]): i for i in order}
+
+        for fut in pbar(as_completed(futures), total=len(futures), desc="processing video(s)", position=0, leave=True):
+            # merge the results back into the original container (keeps the original order of videos)
+            vd = videos[futures[fut]]
+            merge_results(vd, fut.result())
+            store_results(store, CLIARGS, vd)
+            on_done(vd)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+
+
+def video_identity(path: Path) -> dict:
+    """ cheap identity of a video file (a changed file will almost certainly have a different size or mtime). """
+
+    stat = Path(path).stat()
+    return {"path": str(Path(path).resolve()), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+def hash_key(spec: dict) -> str:
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def keypoints_2_array(kps: tuple[cv.KeyPoint]) -> NDArray[np.float32]:
+    return np.float32([(*kp.pt, kp.size, kp.angle, kp.response, kp.octave, kp.class_id) for kp in kps]).reshape(-1, 7)
+
+def array_2_keypoints(arr: NDArray[np.float32]) -> tuple[cv.KeyPoint]:
+    return tuple(cv.KeyPoint(x, y, sz, an, re, int(oc), int(ci)) for x, y, sz, an, re, oc, ci in arr.tolist())
+
+class ReferenceCache:
+    """ on-disk cache for the static reference frame and its keypoints/descriptors. Every entry is one compressed npz file named by the hash of everything the reference depends on. The cache is size-bounded, when it grows too large, the least recently used entries (by file mtime, which is refreshed on every hit) are evicted. Entries are written atomically, so that multiple worker processes can share one cache directory. """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"ref_{key}.npz"
+
+    def load(self, key: str) -> tuple[NDArray[np.uint8], tuple[cv.KeyPoint], NDArray] | None:
+
+        path = self._entry_path(key)
+        try:
+            with np.load(path) as entry:
+                static_frame = entry["static_frame"]
+                kps = array_2_keypoints(entry["keypoints"])
+                dsc = entry["descriptors"]
+        except (OSError, KeyError, ValueError):
+            return None # missing or unreadable (e.g. partially evicted) -> just recompute
+
+        os.utime(path) # mark as recently used
+        return static_frame, kps, dsc
+
+    def store(self, key: str, static_frame: NDArray[np.uint8], kps: tuple[cv.KeyPoint], dsc: NDArray) -> None:
+
+        path = self._entry_path(key)
+        path_tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(path_tmp, mode="wb") as file:
+            np.savez_compressed(file, static_frame=static_frame, keypoints=keypoints_2_array(kps), descriptors=dsc)
+        os.replace(path_tmp, path)
+
+        self.evict()
+
+    def evict(self) -> None:
+
+        entries = []
+        for path in self.cache_dir.glob("ref_*.npz"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue # evicted by another process in the meantime
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # delete least recently used entries first until the cache fits the size limit again
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+class ResultStore:
+    """ on-disk store for the results of process_video (one npz file per video). Every entry also holds the spec (video identity and all parameters that influence the results) that produced it, so a rerun can skip all videos whose spec did not change. """
+
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, video_path: Path) -> Path:
+        return self.store_dir / f"res_{Path(video_path).stem}_{hash_key(str(Path(video_path).resolve()))[0:10]}.npz"
+
+    def load(self, spec: dict, video_path: Path) -> dict | None:
+        """ returns the stored results, but only if they were produced with exactly the same spec. """
+
+        try:
+            with np.load(self._entry_path(video_path)) as entry:
+                if str(entry["spec"]) != json.dumps(spec, sort_keys=True, default=str):
+                    return None # outdated (video or parameters changed)
+                keys = ["timestamps", "movements", "agreements", "errors", "subframes", "detections", "reference"]
+                return {ky: entry[ky] for ky in keys}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def store(self, spec: dict, video_path: Path, results: dict) -> None:
+
+        path = self._entry_path(video_path)
+        path_tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(path_tmp, mode="wb") as file:
+            np.savez_compressed(file, spec=json.dumps(spec, sort_keys=True, default=str), **results)
+        os.replace(path_tmp, path)
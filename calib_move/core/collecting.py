@@ -1,16 +1,18 @@
 import re
 from pathlib import Path
 
-import cv2 as cv
-
-from ..config.coreconfig import ALLOWED_VIDEO_EXT
+from ..config.coreconfig import ALLOWED_VIDEO_EXT, DecodeBackend
 from ..util.util import json_2_dict, tstr_2_sec
 from .containers import CLIArgs, VideoContainer
 
 
-def subcollect_single(vid_path: Path, window: str | dict) -> list[VideoContainer]:
+def subcollect_single(
+    vid_path: Path, 
+    window: str | dict, 
+    backend: DecodeBackend = DecodeBackend.OPENCV,
+) -> list[VideoContainer]:
 
-    cap = cv.VideoCapture(vid_path)
+    source = backend.open(vid_path) # only for the metadata, frame indices have to match the decoding later on
     
     if isinstance(window, dict):
         window = window[vid_path.name] # only care about current video timestring
@@ -28,7 +30,7 @@ def subcollect_single(vid_path: Path, window: str | dict) -> list[VideoContainer
     elif len(re.findall(r"\d\d:\d\d:\d\d-END", window)) > 0:
         tstr = re.findall(r"\d\d:\d\d:\d\d-END", window)[0]
         t0 = tstr_2_sec(tstr.split("-")[0])
-        t1 = cap.get(cv.CAP_PROP_FRAME_COUNT) / cap.get(cv.CAP_PROP_FPS)
+        t1 = source.n_frames / source.fps
         window_sec = [t0, t1]
     
     # when string hh:mm:ss-hh:mm:ss --------------------------------------------  
@@ -43,14 +45,14 @@ def subcollect_single(vid_path: Path, window: str | dict) -> list[VideoContainer
 
     vid = VideoContainer(
         path=vid_path,
-        fpsc=cap.get(cv.CAP_PROP_FPS),
-        ftot=cap.get(cv.CAP_PROP_FRAME_COUNT),
-        H=int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)),
-        W=int(cap.get(cv.CAP_PROP_FRAME_WIDTH)),
+        fpsc=source.fps,
+        ftot=source.n_frames,
+        H=source.H,
+        W=source.W,
         static_window=window_sec,
     )
     
-    cap.release()
+    source.release()
 
     return [vid]
 
@@ -59,7 +61,7 @@ def subcollect_multi(CLIARGS: CLIArgs, window: str | dict) -> list[VideoContaine
     videos = []
     videos_paths = [Path(vd) for xt in ALLOWED_VIDEO_EXT for vd in CLIARGS.input_path.glob(f"*{xt}")]
     for vid_path in videos_paths:
-        videos += subcollect_single(vid_path, window)
+        videos += subcollect_single(vid_path, window, CLIARGS.decode_backend)
 
     return videos
 
@@ -73,7 +75,7 @@ def collect_videos(CLIARGS: CLIArgs) -> list[VideoContainer]:
         # window string --------------------------------------------------------
         else:
             window = CLIARGS.static_window
-        videos = subcollect_single(CLIARGS.input_path, window)      
+        videos = subcollect_single(CLIARGS.input_path, window, CLIARGS.decode_backend)      
     
     # video folder -----------------------------------------------------------------------------------------------------
     else:
@@ -3,10 +3,22 @@ from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Annotated
 
+import numpy as np
 import tyro
 from numpy.typing import NDArray
 
-from ..config.coreconfig import ALLOWED_VIDEO_EXT, InitFrameBlending, KeypointDetector, KeypointMatcher
+from ..config.coreconfig import (
+    ALLOWED_VIDEO_EXT,
+    MIN_MATCHES_HO,
+    N_SUBFR,
+    DecodeBackend,
+    ExportFormat,
+    InitFrameBlending,
+    KeypointDetector,
+    KeypointMatcher,
+    OutputMode,
+    PlotBackend,
+)
 from ..util.util import json_2_dict
 
 
@@ -31,20 +43,86 @@ class CLIArgs:
     plot_name: str = "camera_movement_plot"
     """ base name for the output png file (will be: <plot_name>.png). """
     
+    plot_backend: PlotBackend = PlotBackend.PLOTLY
+    """ backend for rendering the plots. PLOTLY renders plotly figures via kaleido, RASTER draws the same plot directly with cv2 (much faster for many videos). """
+    
+    output_mode: OutputMode = OutputMode.STITCHED
+    """ how the plots are written. STITCHED writes one image with all videos (<plot_name>.png), PAGED one image per page_size videos (<plot_name>_page_<i>.png) and PER_VIDEO one image per video (<plot_name>_<video-name>.png). PAGED and PER_VIDEO write the plots as soon as the videos are done (flat memory for any batch size) and an html index (<plot_name>_index.html). """
+    
+    page_size: int = 20
+    """ number of videos per page (for output_mode PAGED). """
+    
+    export_formats: tuple[ExportFormat, ...] = ()
+    """ formats in which the numeric results (time, movement, agreement and error flag of every main step) are exported together with the video metadata and processing parameters. per video to <output_path>/export/<video-name>.<ext> (as soon as the video is done) and for the whole batch to <output_path>/<plot_name>_results.<ext>. no export if empty. """
+    
+    heatmap: bool = False
+    """ additionally write an inlier density heatmap over the reference frame for every video (<plot_name>_<video-name>_heatmap.png). shows which static regions carry the movement estimate. """
+    
     n_init_steps: int = 8
     """ number of equally spaced steps (in the static window) for which frames are extracted and combined to form one good reference image without moving elements. the homography is estimated relative to this static image for all other parts of the video. """
     
     init_frame_blending: InitFrameBlending = InitFrameBlending.KDE
     """ method for combining multiple frames (from the static window) to ideally remove moving elements. """
+    
+    blend_native_res: bool = False
+    """ run the KDE frame blending at native resolution (instead of at ~1 MP and upscaled again). keeps the details of the reference for high resolution cameras. memory stays bounded by BLEND_MEM_BUDGET_MB (tiled processing, the resolution is reduced if the frames do not fit). """
 
     n_main_steps: int = 16
     """ number of equally spaced steps (in the input video) for which the homography is estimated relative to the static frame. """
     
+    adaptive_thresh: float | None = None
+    """ adaptive temporal sampling: n_main_steps only sets the initial coarse grid. wherever the movements of two consecutive steps differ by more than adaptive_thresh [px], the interval between them is bisected recursively (down to adaptive_resolution), which localizes movement events without evaluating dense steps over long static parts. None samples uniformly. """
+    
+    adaptive_resolution: float = 5.0
+    """ time resolution [s] down to which adaptive sampling bisects (shorter intervals are not split any further). """
+    
+    early_agreement: int | None = None
+    """ the sub-frames of a main step are evaluated in temporal order and the evaluation stops at the first failed sub-frame (the step is an error anyways). With early_agreement, it also stops as soon as this many sub-frames agree on the movement (agreement >= EARLY_AGREEMENT_THRESH), the remaining sub-frames are neither decoded nor matched. None always evaluates all N_SUBFR sub-frames of a good step. """
+    
     detector: KeypointDetector = KeypointDetector.AKAZE
     """ cv2 keypoint detector type. """
     
+    max_keypoints: int | None = None
+    """ keypoint budget per frame (static frame and sub-frames). the strongest keypoints are selected evenly from a KP_GRID x KP_GRID grid, so that the coverage of the image stays even. speeds up matching and RANSAC on busy scenes. None keeps all keypoints. """
+    
     matcher: KeypointMatcher = KeypointMatcher.BF_NORM_HAMM
-    """ cv2 keypoint matching type. (L2 is good for SIFT or SURF, HAMMING is good for binary descriptors e.g. ORB AKAZE or BRISK). """
+    """ cv2 keypoint matching type. (L2 is good for SIFT or SURF, HAMMING is good for binary descriptors e.g. ORB AKAZE or BRISK). the FLANN matchers are approximate but much faster for many keypoints (KDTREE for SIFT, LSH for ORB or AKAZE). """
+    
+    match_ratio: float | None = None
+    """ use kNN matching with a ratio test: a match is only kept if its distance is below match_ratio times the distance of the second best candidate (e.g. 0.8). None matches without ratio test. """
+    
+    cache_dir: Path | None = None
+    """ directory for caching the static reference frames (blended image, keypoints and descriptors). a reference is reused as long as the video, static window, n_init_steps, blending method, detector and processing scale are unchanged. no caching if not given. """
+    
+    incremental: bool = False
+    """ store the results of every video in the output path (.calib_move_results) and on reruns only process videos that are new or whose file or processing parameters changed. all videos are still plotted. """
+    
+    workers: int = 1
+    """ number of worker processes for batch mode. each video is processed in its own process (longest videos first). 1 processes all videos serially in the main process. """
+    
+    proc_scale: float | None = 1.0
+    """ scale at which keypoints are detected and matched (static frame and all sub-frames are downscaled before detection, results are always reported in native pixels). None chooses the scale automatically from the video resolution (longer side at most PROC_AUTO_MAX_SIDE px). """
+    
+    refine_full_res: bool = False
+    """ when processing at a reduced scale: evaluate main steps again at full resolution, but only where the coarse estimate is ambiguous (failed or low agreement). """
+    
+    snap_keyframes: bool = False
+    """ snap the main and sub-frame indices to the nearest keyframe (within KEYFRAME_SNAP_TOL), so that every read only costs a single frame decode. the keyframe index of each video is built in a cheap pre-pass and cached next to the video (.<video-name>.keyframes.npy). """
+    
+    threads: int = 1
+    """ number of detector/matcher threads per video. the sub-frames are decoded sequentially and evaluated concurrently by the threads (each with its own detector and matcher). 1 evaluates all sub-frames serially. """
+    
+    decode_backend: DecodeBackend = DecodeBackend.OPENCV
+    """ video decoding backend. OPENCV uses cv2.VideoCapture, PYAV decodes with libav through PyAV (pip install av): multi-threaded decoding and exact seeking by timestamp. """
+    
+    decode_threads: int = 0
+    """ number of decoding threads per video (0 leaves it to the backend, usually one per core). """
+    
+    decode_luma: bool = False
+    """ decode frames as gray straight from the luma plane (8 bit planar yuv videos) and downscale them while decoding, instead of converting them to BGR and then to gray. faster and less memory bandwidth, but the gray values differ slightly from the conversion (a few gray values, also depending on the colors), so the results differ slightly. """
+    
+    profile: bool = False
+    """ record the wall time, cpu time and number of calls of every processing stage (decode/seek, detection, matching, RANSAC, homography evaluation, frame blending, main mode kde, plotting) per video. prints a summary table and writes the full report to <output_path>/<plot_name>_profile.json. """
 
     def _sanitize_input_video_path(self) -> None:
 
@@ -139,16 +217,50 @@ class CLIArgs:
         
         if self.n_main_steps <= 1:
             raise ValueError(f"{self.n_main_steps=} too small! (minimum 2)")
+        
+        if self.adaptive_thresh is not None and self.adaptive_thresh <= 0:
+            raise ValueError(f"{self.adaptive_thresh=} invalid! (has to be > 0 or None for uniform sampling)")
+        
+        if self.adaptive_resolution <= 0:
+            raise ValueError(f"{self.adaptive_resolution=} invalid! (has to be > 0)")
+        
+        if self.early_agreement is not None and not (2 <= self.early_agreement <= N_SUBFR):
+            raise ValueError(f"{self.early_agreement=} invalid! (has to be in [2, {N_SUBFR}] or None)")
+    
+    def _sanitize_proc_scale(self) -> None:
+        if self.proc_scale is not None and not (0 < self.proc_scale <= 1):
+            raise ValueError(f"{self.proc_scale=} invalid! (has to be in (0, 1] or None for automatic)")
+    
+    def _sanitize_workers(self) -> None:
+        if self.workers < 1:
+            raise ValueError(f"{self.workers=} too small! (minimum 1)")
+        
+        if self.threads < 1:
+            raise ValueError(f"{self.threads=} too small! (minimum 1)")
+        
+        if self.page_size < 1:
+            raise ValueError(f"{self.page_size=} too small! (minimum 1)")
+    
+    def _sanitize_decoding(self) -> None:
+        if self.decode_threads < 0:
+            raise ValueError(f"{self.decode_threads=} invalid! (has to be >= 0, 0 for automatic)")
+        
+        if self.decode_backend.available() is False:
+            raise ValueError(f"decode backend {self.decode_backend.name} is not available! (PYAV needs PyAV: pip install av)")
      
     def _sanitize_detector_matcher(self) -> None:        
-        if (self.detector is KeypointDetector.SIFT) and (self.matcher is KeypointMatcher.BF_NORM_HAMM):
+        if (self.detector is KeypointDetector.SIFT) and (self.matcher in (KeypointMatcher.BF_NORM_HAMM, KeypointMatcher.FLANN_LSH)):
             raise ValueError(
-                f"BF_NORM_HAMM can only be used with binary descriptors such as ORB or AKAZE! (got {self.detector})"
+                f"{self.matcher.name} can only be used with binary descriptors such as ORB or AKAZE! (got {self.detector})"
             )
-        if (self.detector is KeypointDetector.ORB or self.detector is KeypointDetector.AKAZE) and (self.matcher is KeypointMatcher.BF_NORM_L2):
+        if (self.detector is KeypointDetector.ORB or self.detector is KeypointDetector.AKAZE) and (self.matcher in (KeypointMatcher.BF_NORM_L2, KeypointMatcher.FLANN_KDTREE)):
             raise ValueError(
-                f"With binary descriptors (ORB, AKAZE) it is preferred to use BF_NORM_HAMM! (got {self.detector})"
+                f"With binary descriptors (ORB, AKAZE) it is preferred to use BF_NORM_HAMM or FLANN_LSH! (got {self.detector})"
             )
+        if self.match_ratio is not None and not (0 < self.match_ratio < 1):
+            raise ValueError(f"{self.match_ratio=} invalid! (has to be in (0, 1) or None)")
+        if self.max_keypoints is not None and self.max_keypoints < MIN_MATCHES_HO:
+            raise ValueError(f"{self.max_keypoints=} too small! (minimum {MIN_MATCHES_HO} or None)")
            
     def sanitize(self) -> None:
         self._sanitize_input_video_path()
@@ -156,6 +268,41 @@ class CLIArgs:
         self._sanitize_static_window()
         self._sanitize_steps()
         self._sanitize_detector_matcher()
+        self._sanitize_proc_scale()
+        self._sanitize_workers()
+        self._sanitize_decoding()
+
+@dataclass(frozen=True)
+class WatchArgs(CLIArgs):
+    """ arguments of the watch-folder mode. input_path has to be a folder (which may still be empty) and a json static window may be missing keys for videos that did not arrive yet (they are checked per video on arrival). """
+    
+    poll_interval: float = 10.0
+    """ interval [s] in which the folder is checked for new videos. """
+    
+    stable_polls: int = 2
+    """ number of consecutive polls in which the size of a new video must not change before it is considered fully written. """
+    
+    def _sanitize_input_video_path(self) -> None:
+        if self.input_path.is_dir() is False:
+            raise ValueError(f"input path has to be a folder in watch mode! (got {self.input_path})")
+    
+    def _sanitize_static_window(self) -> None:
+        if self._validate_window_str(self.static_window) is True and not Path(self.static_window).is_file():
+            return # OK (found a good string arg)
+        elif Path(self.static_window).is_file() and Path(self.static_window).suffix == ".json":
+            json_2_dict(Path(self.static_window)) # only has to be a valid json, keys are checked on arrival
+        else:
+            raise ValueError(f"invalid static_window, neither json nor valid window! (got {self.static_window})")
+    
+    def _sanitize_polling(self) -> None:
+        if self.poll_interval <= 0:
+            raise ValueError(f"{self.poll_interval=} too small! (has to be > 0)")
+        if self.stable_polls < 1:
+            raise ValueError(f"{self.stable_polls=} too small! (minimum 1)")
+    
+    def sanitize(self) -> None:
+        super().sanitize()
+        self._sanitize_polling()
 
 @dataclass
 class VideoContainer:
@@ -169,12 +316,18 @@ class VideoContainer:
 
     static_window: tuple[float, float] # [start_second, end_second]
 
+    timestamps: list[float] = field(default_factory=list) # [s] of each main step
     movements: list[float] = field(default_factory=list)
     agreements: list[float] = field(default_factory=list)
     errors: list[bool] = field(default_factory=list)
+    subframes: list[int] = field(default_factory=list) # number of evaluated sub-frames of each main step (early exit)
 
-    detections: list[any] = field(default_factory=list)
+    detections: NDArray = field(default_factory=lambda: np.zeros((0, 3), dtype=np.float32)) # [main step, x, y] of all inliers
     sections: list[NDArray] = field(default_factory=list)
+    
+    profile: dict = field(default_factory=dict) # stage -> [calls, wall [s], cpu [s]] (only with --profile)
+    reference: NDArray | None = None # downscaled reference frame (background of the heatmap, dropped once written)
+    keyframes: NDArray | None = None # frame indices of all keyframes (only loaded when snapping to keyframes)
 
     @property
     def stot(self):
@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+
+from ..config.coreconfig import ExportFormat
+from ..util.profiling import format_profile_table, profile_summary
+from .containers import CLIArgs, VideoContainer
+from .processing import processing_spec
+
+# folder (inside the output path) for the per video exports
+EXPORT_DIR = "export"
+
+# columns of the tabular exports (one row per main step)
+EXPORT_COLUMNS = ["video", "step", "time_s", "movement_px", "agreement", "error", "subframes"]
+
+
+def run_params(CLIARGS: CLIArgs, video: VideoContainer) -> dict:
+    """ all processing parameters (the processing spec without the video identity and static window). """
+
+    spec = processing_spec(CLIARGS, video)
+    return {ky: vl for ky, vl in spec.items() if ky not in ["video", "static_window"]}
+
+def video_meta(video: VideoContainer) -> dict:
+    return {
+        "name": video.name,
+        "path": str(Path(video.path).resolve()),
+        "fpsc": float(video.fpsc),
+        "ftot": int(video.ftot),
+        "H": int(video.H),
+        "W": int(video.W),
+        "static_window": [float(sw) for sw in video.static_window],
+    }
+
+def video_columns(video: VideoContainer) -> dict[str, np.ndarray]:
+    return {
+        "time_s": np.array(video.timestamps, dtype=np.float64),
+        "movement_px": np.array(video.movements, dtype=np.float64),
+        "agreement": np.array(video.agreements, dtype=np.float64),
+        "error": np.array(video.errors, dtype=bool),
+        "subframes": np.array(video.subframes, dtype=np.int64),
+    }
+
+def columns_2_json(columns: dict[str, np.ndarray]) -> dict[str, list]:
+    # NaN (failed steps) is not valid json -> null
+    return {ky: [None if (isinstance(vl, float) and np.isnan(vl)) else vl for vl in col.tolist()] for ky, col in columns.items()}
+
+def write_atomic(path: Path, write: Callable, mode: str = "w") -> None:
+    # readers (e.g. an alerting job polling the output folder) never see half written files
+    path_tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(path_tmp, mode=mode, **({"newline": "", "encoding": "utf-8"} if mode == "w" else {})) as file:
+        write(file)
+    os.replace(path_tmp, path)
+
+def write_csv(path: Path, rows: list[list]) -> None:
+    write_atomic(path, lambda file: csv.writer(file).writerows([EXPORT_COLUMNS, *rows]))
+
+def csv_rows(video: VideoContainer) -> list[list]:
+    columns = video_columns(video)
+    return [
+        [video.name, st, tm, mv, ag, int(er), sf]
+        for st, (tm, mv, ag, er, sf) in enumerate(zip(*[columns[ky].tolist() for ky in EXPORT_COLUMNS[2:]]))
+    ]
+
+def export_video(CLIARGS: CLIArgs, video: VideoContainer) -> None:
+    """ writes the results of one video (per main step: time, movement, agreement, error flag, number of evaluated sub-frames), its metadata and the processing parameters in all selected formats to <output_path>/export/<video-name>.<ext>. """
+
+    if len(CLIARGS.export_formats) == 0:
+        return
+
+    export_dir = CLIARGS.output_path/EXPORT_DIR
+    export_dir.mkdir(parents=True, exist_ok=True)
+    meta = video_meta(video)
+    params = run_params(CLIARGS, video)
+    columns = video_columns(video)
+
+    if ExportFormat.NPZ in CLIARGS.export_formats:
+        write_atomic(export_dir/f"{video.path.stem}.npz", lambda file: np.savez_compressed(
+            file, **columns, meta=json.dumps(meta), params=json.dumps(params, default=str),
+        ), mode="wb")
+
+    if ExportFormat.CSV in CLIARGS.export_formats:
+        write_csv(export_dir/f"{video.path.stem}.csv", csv_rows(video))
+
+    if ExportFormat.JSON in CLIARGS.export_formats:
+        write_atomic(export_dir/f"{video.path.stem}.json", lambda file: json.dump(
+            {"video": meta, "params": params, "steps": columns_2_json(columns)}, file, default=str,
+        ))
+
+def export_batch(CLIARGS: CLIArgs, videos: list[VideoContainer]) -> None:
+    """ writes the results of all videos into one file per format (<output_path>/<plot_name>_results.<ext>). The npz holds the steps of all videos concatenated (columnar), the steps of video i are [offsets[i], offsets[i+1]). """
+
+    videos = [vd for vd in videos if len(vd.movements) > 0] # failed videos have no results
+    if len(CLIARGS.export_formats) == 0 or len(videos) == 0:
+        return
+
+    metas = [video_meta(vd) for vd in videos]
+    columns = [video_columns(vd) for vd in videos]
+    params = [run_params(CLIARGS, vd) for vd in videos] # per video (e.g. the automatic processing scale can differ)
+    path = CLIARGS.output_path/f"{CLIARGS.plot_name}_results"
+
+    if ExportFormat.NPZ in CLIARGS.export_formats:
+        lengths = [len(col["time_s"]) for col in columns]
+        batch = {ky: np.concatenate([col[ky] for col in columns]) for ky in EXPORT_COLUMNS[2:]}
+        write_atomic(path.with_suffix(".npz"), lambda file: np.savez_compressed(
+            file,
+            **batch,
+            video_idx=np.repeat(np.arange(len(videos)), lengths),
+            offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            names=np.array([mt["name"] for mt in metas], dtype=str),
+            fpsc=np.array([mt["fpsc"] for mt in metas], dtype=np.float64),
+            ftot=np.array([mt["ftot"] for mt in metas], dtype=np.int64),
+            static_windows=np.array([mt["static_window"] for mt in metas], dtype=np.float64).reshape(-1, 2),
+            meta=json.dumps(metas),
+            params=json.dumps(params, default=str),
+        ), mode="wb")
+
+    if ExportFormat.CSV in CLIARGS.export_formats:
+        write_csv(path.with_suffix(".csv"), [row for vd in videos for row in csv_rows(vd)])
+
+    if ExportFormat.JSON in CLIARGS.export_formats:
+        write_atomic(path.with_suffix(".json"), lambda file: json.dump({
+            "videos": [
+                {"video": mt, "params": pr, "steps": columns_2_json(col)} for mt, pr, col in zip(metas, params, columns)
+            ],
+        }, file, default=str))
+
+def export_profile(CLIARGS: CLIArgs, videos: list[VideoContainer], wall: float) -> None:
+    """ writes the per stage profile of every video and the sum over all videos to <output_path>/<plot_name>_profile.json and prints the summary table (with --profile only). wall is the wall time of the whole batch. Videos whose results were loaded (incremental) only have the plotting stage. """
+
+    if CLIARGS.profile is False:
+        return
+
+    videos = [vd for vd in videos if len(vd.profile) > 0]
+    summary = profile_summary([vd.profile for vd in videos])
+    report = {
+        "batch_wall_s": wall,
+        "cpu_count": os.cpu_count(),
+        "workers": CLIARGS.workers,
+        "threads": CLIARGS.threads,
+        "total": summary,
+        "videos": [
+            {"name": vd.name, "ftot": int(vd.ftot), "resolution": [int(vd.W), int(vd.H)], "stages": profile_summary([vd.profile])}
+            for vd in videos
+        ],
+    }
+    write_atomic(CLIARGS.output_path/f"{CLIARGS.plot_name}_profile.json", lambda file: json.dump(report, file, indent=4))
+
+    print(f"\nprofile of {len(videos)} video(s), batch wall time {wall:.2f} s:")
+    print(format_profile_table(summary))
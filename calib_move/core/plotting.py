@@ -1,22 +1,45 @@
+import cv2 as cv
 import numpy as np
 import plotly.graph_objects as go
 from numpy.typing import NDArray
 from plotly.subplots import make_subplots
 
+from ..config.coreconfig import PlotBackend
 from ..config.plotconfig import PlotConfig
-from ..util.plot import fig_2_numpy
+from ..util.plot import draw_rgba, fig_2_numpy, put_text, rgba_2_bgr, rgba_2_bgr_flat
+from ..util.profiling import profile
 from ..util.util import sec_2_tstr
 from .containers import CLIArgs, VideoContainer
 
 
+@profile("plot")
 def plot_video(CLIARGS: CLIArgs, PCFG: PlotConfig, video: VideoContainer) -> list[NDArray]:
+    """ renders the motion plot of one video (BGR image) with the selected plot backend. """
+    
+    if CLIARGS.plot_backend is PlotBackend.RASTER:
+        return plot_video_raster(CLIARGS, PCFG, video)
+    return plot_video_plotly(CLIARGS, PCFG, video)
+
+def step_widths(times: NDArray, time_max: float) -> NDArray:
+    """ width of the time interval that each step stands for: from halfway to its left to halfway to its right neighbour. The first and last step are symmetric, but do not reach beyond the start or end of the video. """
+    
+    if len(times) < 2:
+        return np.full(len(times), time_max)
+    gaps = np.diff(times)
+    widths = 0.5*(np.concatenate([[gaps[0]], gaps]) + np.concatenate([gaps, [gaps[-1]]]))
+    widths[0] = min(widths[0], 2*times[0])
+    widths[-1] = min(widths[-1], 2*(time_max - times[-1]))
+    return widths
+
+def plot_data(CLIARGS: CLIArgs, PCFG: PlotConfig, video: VideoContainer) -> dict:
+    """ data and axis ranges of the motion plot (shared by all plot backends). """
     
     # prepare data to plot. Plotly has a nice feature where if a datapoint has NaN values, it will be hidden and it handles it gracefully. Since the motion and agreement values are filled with NaN where an error occured, these points will be hidden. The time coordinate does not need to have NaNs as one is sufficient to hide the datapoint.
-    data_time = np.linspace(0, video.stot, CLIARGS.n_main_steps)
+    data_time = np.array(video.timestamps) # not necessarily uniform (adaptive sampling)
     data_move = np.array(video.movements)
     data_agrm = np.array(video.agreements)
     data_errs = np.array(video.errors) # False = good value, True = error
-    data_time_max = data_time[-1]
+    data_time_max = video.stot
     if np.all(data_errs==True): # handle NaN-only-data case
         data_move_max = PCFG.MIN_YRANGE_AUTOMAX
         data_agrm_max = 1.0
@@ -24,16 +47,31 @@ def plot_video(CLIARGS: CLIArgs, PCFG: PlotConfig, video: VideoContainer) -> lis
         data_move_max = max(np.nanmax(data_move), PCFG.MIN_YRANGE_AUTOMAX) 
         data_agrm_max = 1.0
     
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-    
-    # plotting ---------------------------------------------------------------------------------------------------------
-
-    UNITWIDTH_BARS = data_time_max/(CLIARGS.n_main_steps-1) # bars scale with domain (half is outside at edge)
-    UNITWIDTH_MARK = PCFG.WIDTH_MARK_BASE/CLIARGS.n_main_steps # markers scale with plot resolution
-    CONTENTPADD = PCFG.WIDTH_MARK*(data_time_max/(CLIARGS.n_main_steps-1))*0.5 # padding for the actual plot contents
+    UNITWIDTH_BARS = step_widths(data_time, data_time_max) # bars scale with domain (each step covers the time up to its neighbours)
+    UNITWIDTH_MARK = PCFG.WIDTH_MARK_BASE*UNITWIDTH_BARS/data_time_max # markers scale with plot resolution
+    CONTENTPADD = PCFG.WIDTH_MARK*max(UNITWIDTH_BARS[0], UNITWIDTH_BARS[-1])*0.5 # padding for the actual plot contents
     XRANGE = [-(PCFG.PADD_X*data_time_max + CONTENTPADD), (CONTENTPADD + (PCFG.PADD_X+1)*data_time_max)]
     YRANGE1 = [-(1.00*PCFG.PADD_Y)*data_move_max, (0.30*PCFG.PADD_Y + 1)*data_move_max]
     YRANGE2 = [-(1.00*PCFG.PADD_Y)*data_agrm_max, (0.30*PCFG.PADD_Y + 1)*data_agrm_max]
+    
+    return dict(
+        data_time=data_time, data_move=data_move, data_agrm=data_agrm, data_errs=data_errs,
+        data_time_max=data_time_max, data_move_max=data_move_max, data_agrm_max=data_agrm_max,
+        UNITWIDTH_BARS=UNITWIDTH_BARS, UNITWIDTH_MARK=UNITWIDTH_MARK, 
+        XRANGE=XRANGE, YRANGE1=YRANGE1, YRANGE2=YRANGE2,
+    )
+
+def plot_video_plotly(CLIARGS: CLIArgs, PCFG: PlotConfig, video: VideoContainer) -> list[NDArray]:
+    
+    pdata = plot_data(CLIARGS, PCFG, video)
+    data_time, data_move, data_agrm, data_errs = (pdata[ky] for ky in ["data_time", "data_move", "data_agrm", "data_errs"])
+    data_time_max, data_move_max, data_agrm_max = (pdata[ky] for ky in ["data_time_max", "data_move_max", "data_agrm_max"])
+    UNITWIDTH_BARS, UNITWIDTH_MARK = pdata["UNITWIDTH_BARS"], pdata["UNITWIDTH_MARK"]
+    XRANGE, YRANGE1, YRANGE2 = pdata["XRANGE"], pdata["YRANGE1"], pdata["YRANGE2"]
+    
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    
+    # plotting ---------------------------------------------------------------------------------------------------------
 
     # plot 1: time series movements --------------------------------------------
     fig.add_trace(go.Scatter( # main error plot
@@ -183,3 +221,123 @@ def plot_video(CLIARGS: CLIArgs, PCFG: PlotConfig, video: VideoContainer) -> lis
     )
 
     return [fig_2_numpy(fig)[..., 0:3]]
+
+def format_si(value: float) -> str:
+    """ tick label with 2 significant digits and SI suffix (like the plotly tickformat ".2~s"). """
+    
+    for factor, suffix in [(1e9, "G"), (1e6, "M"), (1e3, "k")]:
+        if abs(value) >= factor:
+            return format_si(value / factor) + suffix
+    return np.format_float_positional(value, precision=2, unique=False, fractional=False, trim="-")
+
+def plot_video_raster(CLIARGS: CLIArgs, PCFG: PlotConfig, video: VideoContainer) -> list[NDArray]:
+    """ draws the same motion plot as plot_video_plotly directly into an array with cv2 (no browser based rendering and no png round trip). Much faster for many videos, but with the simpler cv2 font. """
+    
+    pdata = plot_data(CLIARGS, PCFG, video)
+    data_time, data_move, data_agrm, data_errs = (pdata[ky] for ky in ["data_time", "data_move", "data_agrm", "data_errs"])
+    data_time_max, data_move_max, data_agrm_max = (pdata[ky] for ky in ["data_time_max", "data_move_max", "data_agrm_max"])
+    UNITWIDTH_BARS = pdata["UNITWIDTH_BARS"]
+    XRANGE, YRANGE1, YRANGE2 = pdata["XRANGE"], pdata["YRANGE1"], pdata["YRANGE2"]
+    
+    # canvas and plot area (the bottom margin additionally holds the x tick labels) ------------------------------------
+    H, W = PCFG.PLOT_RES
+    img = np.full((H, W, 3), rgba_2_bgr(PCFG.COL_BAKG)[0], dtype=np.uint8)
+    PX0 = PCFG.MARGIN["l"]
+    PX1 = W - PCFG.MARGIN["r"]
+    PY0 = PCFG.MARGIN["t"]
+    PY1 = H - PCFG.MARGIN["b"] - PCFG.FNTSIZE_PLOT
+    
+    def _px(x: NDArray) -> NDArray:
+        return PX0 + (np.asarray(x) - XRANGE[0]) / (XRANGE[1] - XRANGE[0]) * (PX1 - PX0)
+    def _py1(y: NDArray) -> NDArray:
+        return PY1 - (np.asarray(y) - YRANGE1[0]) / (YRANGE1[1] - YRANGE1[0]) * (PY1 - PY0)
+    def _py2(y: NDArray) -> NDArray:
+        return PY1 - (np.asarray(y) - YRANGE2[0]) / (YRANGE2[1] - YRANGE2[0]) * (PY1 - PY0)
+    def _pt(x: float, y: float) -> tuple[int, int]:
+        return int(round(float(x))), int(round(float(y)))
+    def _rect(canvas: NDArray, x0: float, y0: float, x1: float, y1: float, color: tuple) -> None:
+        # clipped to the plot area (like plotly does)
+        x0, x1 = np.clip(sorted([x0, x1]), PX0, PX1)
+        y0, y1 = np.clip(sorted([y0, y1]), PY0, PY1)
+        cv.rectangle(canvas, _pt(x0, y0), _pt(x1, y1), color, thickness=-1)
+    
+    col_grid = rgba_2_bgr(PCFG.COL_GRID)[0]
+    col_zlin = rgba_2_bgr(PCFG.COL_ZLIN)[0]
+    ticks_x = np.linspace(0, data_time_max, PCFG.N_TIX_X)
+    ticks_y1 = np.linspace(0, data_move_max, PCFG.N_TIX_Y)
+    ticks_y2 = np.linspace(0, data_agrm_max, PCFG.N_TIX_Y)
+    
+    # grid and zero lines ----------------------------------------------------------------------------------------------
+    for tx in ticks_x:
+        cv.line(img, _pt(_px(tx), PY0), _pt(_px(tx), PY1), col_grid, int(PCFG.WIDTH_GRID), cv.LINE_AA)
+    for ty in ticks_y1:
+        cv.line(img, _pt(PX0, _py1(ty)), _pt(PX1, _py1(ty)), col_grid, int(PCFG.WIDTH_GRID), cv.LINE_AA)
+    cv.line(img, _pt(_px(0), PY0), _pt(_px(0), PY1), col_zlin, int(PCFG.WIDTH_ZLIN), cv.LINE_AA)
+    cv.line(img, _pt(PX0, _py1(0)), _pt(PX1, _py1(0)), col_zlin, int(PCFG.WIDTH_ZLIN), cv.LINE_AA)
+    
+    # cosmetics: bar at the right end and static window line (interrupted by the window box) ---------------------------
+    cv.line(img, _pt(_px(data_time_max), PY0), _pt(_px(data_time_max), PY1), col_zlin, int(PCFG.WIDTH_ZLIN), cv.LINE_AA)
+    y_swin = _py1(-(0.75*PCFG.PADD_Y)*data_move_max)
+    draw_rgba(img, PCFG.COL_SWIN, lambda cvs, col: (
+        cv.line(cvs, _pt(PX0, y_swin), _pt(_px(video.static_window[0]), y_swin), col, int(PCFG.WIDTH_GRID), cv.LINE_AA),
+        cv.line(cvs, _pt(_px(video.static_window[1]), y_swin), _pt(PX1, y_swin), col, int(PCFG.WIDTH_GRID), cv.LINE_AA),
+    ))
+    
+    # plot 2: errors hatched and agreement (confidence score) ----------------------------------------------------------
+    if np.any(data_errs):
+        hatch = np.zeros((H, W), dtype=np.uint8)
+        for tm, uw in zip(data_time[data_errs], UNITWIDTH_BARS[data_errs]):
+            _rect(hatch, _px(tm - 0.5*uw), _py2(0), _px(tm + 0.5*uw), _py2(1.0), 1)
+        yy, xx = np.mgrid[0:H, 0:W]
+        hatch &= (((xx + yy) % 16) < 16*0.2).astype(np.uint8) # "/" pattern (size 16, solidity 0.2)
+        draw_rgba(img, PCFG.COL_ERRS, lambda cvs, col: cvs.__setitem__(hatch==1, col))
+    
+    def _draw_bars(cvs: NDArray, col: tuple) -> None:
+        for tm, ag, uw in zip(data_time, data_agrm, UNITWIDTH_BARS):
+            if np.isfinite(ag):
+                _rect(cvs, _px(tm - 0.5*PCFG.WIDTH_BARS*uw), _py2(0), _px(tm + 0.5*PCFG.WIDTH_BARS*uw), _py2(ag), col)
+    draw_rgba(img, PCFG.COL_AGRM, _draw_bars)
+    
+    # plot 1: time series movements (markers with white border) --------------------------------------------------------
+    half_ws = 0.5 * PCFG.WIDTH_MARK * (_px(UNITWIDTH_BARS) - _px(0)) # markers scale with the distance between steps
+    half_h = 0.5 * PCFG.HEIGHT_MARK
+    for border, col in [(PCFG.MARK_BORDER, (255, 255, 255)), (0, rgba_2_bgr(PCFG.COL_MOVE)[0])]:
+        for tm, mv, half_w in zip(data_time, data_move, half_ws):
+            if np.isfinite(mv):
+                x, y = _px(tm), _py1(mv)
+                cv.rectangle(img, _pt(x - half_w - border, y - half_h - border), _pt(x + half_w + border, y + half_h + border), col, -1)
+    
+    # static window box and "ref" text ---------------------------------------------------------------------------------
+    draw_rgba(img, PCFG.COL_SWIN, lambda cvs, col: _rect(
+        cvs, _px(video.static_window[0]), _py1(1.00*YRANGE1[0]), _px(video.static_window[1]), _py1(0.50*YRANGE1[0]), col
+    ))
+    col_swin = rgba_2_bgr_flat(PCFG.COL_SWIN, PCFG.COL_BAKG)
+    put_text(img, "ref", (PX0 - 0.005*(PX1 - PX0), _py1(0.75*YRANGE1[0])), PCFG.FNTSIZE_PLOT, col_swin, ("right", "middle"), bold=True)
+    
+    # ticks, titles and axis titles ------------------------------------------------------------------------------------
+    col_text = rgba_2_bgr(PCFG.COL_TEXT)[0]
+    col_move = rgba_2_bgr_flat(PCFG.COL_MOVE, PCFG.COL_BAKG)
+    col_agrm = rgba_2_bgr_flat(PCFG.COL_AGRM, PCFG.COL_BAKG)
+    pad = PCFG.MARGIN["pad"]
+    for tx in ticks_x:
+        put_text(img, sec_2_tstr(tx), (_px(tx), PY1 + pad), PCFG.FNTSIZE_PLOT, col_text, ("center", "top"))
+    for ty in ticks_y1:
+        put_text(img, format_si(ty), (PX0 - pad, _py1(ty)), PCFG.FNTSIZE_PLOT, col_move, ("right", "middle"), bold=True)
+    for ty in ticks_y2:
+        put_text(img, f"{ty:.2f}", (PX1 + pad, _py2(ty)), PCFG.FNTSIZE_PLOT, col_agrm, ("left", "middle"), bold=True)
+    
+    x_title, y_title = PCFG.TITLE_MAIN_XY[0]*W, (1 - PCFG.TITLE_MAIN_XY[1])*H
+    x_title += put_text(img, "motion plot for: ", (x_title, y_title), PCFG.FNTSIZE_TITLE, col_text, ("left", "top"))
+    put_text(img, video.name, (x_title, y_title), PCFG.FNTSIZE_TITLE, col_text, ("left", "top"), bold=True)
+    
+    y_axtitle = PY1 - PCFG.TITLE_MOVE_XY[1]*(PY1 - PY0)
+    put_text(
+        img, "|x, y| movement [px]", (PX0 + PCFG.TITLE_MOVE_XY[0]*(PX1 - PX0), y_axtitle), 
+        PCFG.FNTSIZE_PLOT, col_text, ("center", "top"), bold=True, vertical=True,
+    )
+    put_text( # right of the tick labels (the cv2 font is wider than the plotly one, so it is kept inside the image)
+        img, "confidence score [%]", (min(PX0 + PCFG.TITLE_AGRM_XY[0]*(PX1 - PX0), W - PCFG.FNTSIZE_PLOT), y_axtitle), 
+        PCFG.FNTSIZE_PLOT, col_text, ("center", "top"), bold=True, vertical=True,
+    )
+    
+    return [img]
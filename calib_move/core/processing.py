@@ -1,165 +1,597 @@
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+from pathlib import Path
+
 import cv2 as cv
 import numpy as np
 from numpy.typing import NDArray
 
 from ..config.coreconfig import (
     AGREEMENT_THRESH,
+    BLEND_MEM_BUDGET_MB,
     BW_MAIN_MODE,
+    EARLY_AGREEMENT_THRESH,
     HO_GRID_RES,
+    KEYFRAME_SNAP_TOL,
+    KP_GRID,
     MIN_MATCHES_HO,
     N_SUBFR,
+    PROC_AUTO_MAX_SIDE,
     RANSAC_REPROJ_THRESH_HO,
+    REF_CACHE_MAX_MB,
+    REFERENCE_THUMB_MAX_SIDE,
+    RESULT_STORE_FORMAT,
+    SEEK_COST_FRAMES,
     T_SUBFR,
+    KeypointMatcher,
 )
-from ..util.util import main_mode_kde, pbar
-from ..util.video import get_video_frame_gry
+from ..util.framesource import FrameSource
+from ..util.profiling import collect_profile, profile, profiled
+from ..util.util import GrowableArray, main_mode_kde, main_mode_kde_batched, pbar
+from ..util.video import FramePlan, downscale_frame, load_keyframe_index, snap_to_keyframes
+from .caching import ReferenceCache, hash_key, video_identity
 from .containers import CLIArgs, VideoContainer
 
 
-def evaluate_homography(HO: NDArray, img_shape: tuple[int, int], resolution: int) -> tuple[float, NDArray]:
+@lru_cache(maxsize=8)
+def evaluation_grid(img_shape: tuple[int, int], resolution: int) -> NDArray[np.float64]:
+    """ evaluation grid of points (resolution x resolution, spanning the whole image) in homogeneous xy coordinates, shape [resolution**2, 3]. cached, since it only depends on the image shape (the same for all homographies of one video). """
     
-    # setup an evaluation grid of points
     mgrid_step = resolution * (1j)
     grid = np.mgrid[0:img_shape[1]:mgrid_step, 0:img_shape[0]:mgrid_step].transpose(2, 1, 0) # xy coord grid (packed)
-    grid = grid.reshape(-1, 1, 2) # xy coords (flattened)
+    grid = grid.reshape(-1, 2) # xy coords (flattened)
+    grid = np.concatenate([grid, np.ones((len(grid), 1))], axis=1)
+    grid.flags.writeable = False # shared between all calls
+    
+    return grid
+
+@profile("evaluate_homography")
+def evaluate_homographies(
+    HOs: NDArray, 
+    img_shape: tuple[int, int], 
+    resolution: int,
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """ evaluates a stack of homographies (shape [K, 3, 3]) on the same grid of points in one pass. returns the mean length of the movement vectors (shape [K]) and the average movement vector (shape [K, 2]) of each homography. """
+    
+    grid = evaluation_grid(tuple(int(sz) for sz in img_shape[0:2]), resolution)
+    HOs = np.asarray(HOs).reshape(-1, 3, 3).astype(np.float32).astype(np.float64) # same precision as cv.perspectiveTransform
+    
+    # warp all gridpoints with all homographies (points at infinity are set to 0, like cv.perspectiveTransform does)
+    warped = np.einsum("kij,pj->kpi", HOs, grid) # [K, P, 3]
+    w = warped[:, :, 2:3]
+    w_ok = np.abs(w) > np.finfo(np.float64).eps
+    warped = np.where(w_ok, warped[:, :, 0:2] / np.where(w_ok, w, 1.0), 0.0)
+    movement = grid[None, :, 0:2] - warped
+    
+    # average length of movement vectors and average vector (to get a sense of average direction)
+    mean_mags = np.mean(np.linalg.norm(movement, axis=2), axis=1)
+    avg_vecs = np.mean(movement, axis=1)
+    
+    return mean_mags, avg_vecs
+
+def evaluate_homography(HO: NDArray, img_shape: tuple[int, int], resolution: int) -> tuple[float, NDArray]:
+    """ evaluates a single homography (see evaluate_homographies). """
+    
+    mean_mags, avg_vecs = evaluate_homographies(HO[None], img_shape, resolution)
+    
+    return mean_mags[0], avg_vecs[0]
+
+def frame_source(CLIARGS: CLIArgs) -> Callable[[Path], FrameSource]:
+    """ opens a video with the selected decoding backend. """
+    
+    return partial(CLIARGS.decode_backend.open, threads=CLIARGS.decode_threads, luma_only=CLIARGS.decode_luma)
+
+def generate_static_frame(CLIARGS: CLIArgs, video: VideoContainer, fidx: NDArray) -> NDArray:
+    
+    # frames are fed to the blending right after decoding (memory stays bounded for any number of init frames). with decode_luma, they are decoded as luma only and right at the resolution of the blending, otherwise they are decoded at native resolution and downscaled by the blending.
+    blending = CLIARGS.init_frame_blending.accumulator(
+        native_res=CLIARGS.blend_native_res, threads=CLIARGS.threads, shape=(video.H, video.W), n_frames=len(fidx),
+    )
+    plan = FramePlan(
+        video.path, fidx, seek_cost=SEEK_COST_FRAMES, keyframes=video.keyframes, open_source=frame_source(CLIARGS), 
+        scale=blending.frame_scale if CLIARGS.decode_luma is True else 1.0,
+    )
+    for _, frame_gry in pbar(plan, desc=f"static frame of {video.name}", position=1, leave=False):
+        blending.add(frame_gry)
+    static_frame = blending.result()
+    
+    return static_frame
 
-    # evaluate the homography at each gridpoint
-    grid_warped = cv.perspectiveTransform(grid, HO.astype(np.float32))
-    grid = grid.squeeze()
-    grid_warped = grid_warped.squeeze()
-    movement = grid - grid_warped
+def proc_scale_matrix(img_shape: tuple[int, int], scale: float) -> NDArray:
+    """ maps native pixel coordinates to the coordinates of the downscaled processing image (cv2 pixel centers). """
+    
+    H, W = img_shape
+    sx = round(W*scale) / W # actual scale after rounding to the integer image size
+    sy = round(H*scale) / H
+    
+    return np.array([[sx, 0, (sx-1)/2], [0, sy, (sy-1)/2], [0, 0, 1]])
 
-    # calculate average length of movement vectors
-    mean_mag = np.mean(np.linalg.norm(movement, axis=1))
+def resolve_proc_scale(CLIARGS: CLIArgs, video: VideoContainer) -> float:
+    
+    # automatic: downscale so that the longer side does not exceed the maximum processing size
+    if CLIARGS.proc_scale is None:
+        return min(1.0, PROC_AUTO_MAX_SIDE / max(video.H, video.W))
+    
+    return CLIARGS.proc_scale
 
-    # calculate the average vector to get a sense of average direction
-    avg_vec = np.mean(movement, axis=0)
+def select_keypoints(
+    kps: tuple[cv.KeyPoint], 
+    dsc: NDArray, 
+    max_keypoints: int | None, 
+    img_shape: tuple[int, int],
+) -> tuple[tuple[cv.KeyPoint], NDArray]:
+    """ limits the number of keypoints to a budget, while keeping the coverage of the image even. The image is split into KP_GRID x KP_GRID cells and the keypoints are taken round-robin from all cells (strongest response first): first the best keypoint of every cell, then the second best, and so on. Cells with few keypoints thereby leave their share of the budget to busier cells. """
+    
+    if max_keypoints is None or len(kps) <= max_keypoints:
+        return kps, dsc
+    
+    H, W = img_shape[0:2]
+    pts = np.float32([kp.pt for kp in kps])
+    response = np.float32([kp.response for kp in kps])
+    cell_x = np.clip((pts[:, 0] * KP_GRID / W).astype(np.int64), 0, KP_GRID-1)
+    cell_y = np.clip((pts[:, 1] * KP_GRID / H).astype(np.int64), 0, KP_GRID-1)
+    cell = cell_y * KP_GRID + cell_x
+    
+    # rank of every keypoint within its cell (0 = strongest response)
+    order = np.lexsort((-response, cell))
+    cell_sorted = cell[order]
+    rank = np.empty(len(kps), dtype=np.int64)
+    rank[order] = np.arange(len(kps)) - np.searchsorted(cell_sorted, cell_sorted, side="left")
+    
+    # round-robin over the cells: lowest rank first, stronger response first within the same rank
+    keep = np.sort(np.lexsort((-response, rank))[0:max_keypoints])
+    
+    return tuple(kps[i] for i in keep), dsc[keep]
 
-    return mean_mag, avg_vec
+@profile("detect")
+def detect_features(
+    detector: cv.Feature2D, 
+    frame_gry: NDArray[np.uint8], 
+    max_keypoints: int | None = None,
+) -> tuple[tuple[cv.KeyPoint], NDArray]:
+    """ keypoint detection and description, optionally limited to a spatially bucketed keypoint budget. """
+    
+    kps, dsc = detector.detectAndCompute(frame_gry, None)
+    if len(kps) == 0:
+        return kps, dsc
+    
+    return select_keypoints(kps, dsc, max_keypoints, frame_gry.shape)
 
-def generate_static_frame(CLIARGS: CLIArgs, video: VideoContainer, fidx: list[int]) -> NDArray:
+class StaticMatcher:
+    """ matches the descriptors of sub-frames against the (fixed) descriptors of the static frame. Brute force matchers with cross checking get both descriptor sets on every call (as cv2 requires). Index based matchers (FLANN) and the kNN ratio test instead train the static frame descriptors into the matcher once, and only the sub-frame descriptors are queried. Each thread needs its own instance. """
+    
+    def __init__(self, kind: KeypointMatcher, dsc_0: NDArray, ratio: float | None = None):
+        self.dsc_0 = dsc_0
+        self.ratio = ratio
+        self.trained = kind.uses_index or ratio is not None
+        self.matcher = kind.instantiate(ratio_test=ratio is not None)
+        if self.trained is True:
+            self.matcher.add([dsc_0])
+            self.matcher.train()
     
-    cap = cv.VideoCapture(video.path)
-    frame_coll = []
-    for fi in pbar(fidx, desc=f"static frame of {video.name}", position=1, leave=False):
-        cap.set(cv.CAP_PROP_POS_FRAMES, fi)
-        ret, frame = cap.read()
-        if ret is False:
-            ValueError("could not read frame")
+    @profile("match")
+    def match(self, dsc_f: NDArray) -> list[tuple[float, int, int]]:
+        """ returns (distance, static frame keypoint idx, sub-frame keypoint idx), sorted by distance (best first). """
+        
+        # brute force with cross check: static frame is the query set (queryIdx -> static, trainIdx -> sub-frame)
+        if self.trained is False:
+            matches = [(ma.distance, ma.queryIdx, ma.trainIdx) for ma in self.matcher.match(self.dsc_0, dsc_f)]
+        
+        # trained index: sub-frame is the query set (queryIdx -> sub-frame, trainIdx -> static)
+        elif self.ratio is None:
+            matches = [(ma.distance, ma.trainIdx, ma.queryIdx) for ma in self.matcher.match(dsc_f)]
+        
+        # kNN with ratio test: only keep matches that are clearly better than the second best candidate
         else:
-            frame_coll.append(cv.cvtColor(frame, cv.COLOR_BGR2GRAY))
-    cap.release()
-    static_frame = CLIARGS.init_frame_blending(frame_coll)
+            matches = [
+                (kn[0].distance, kn[0].trainIdx, kn[0].queryIdx) for kn in self.matcher.knnMatch(dsc_f, k=2)
+                if len(kn) == 2 and kn[0].distance < self.ratio * kn[1].distance
+            ]
+        
+        return sorted(matches, key=lambda x: x[0]) # sort by descriptor distance (better match first)
+
+def evaluate_subframe(
+    detector: cv.Feature2D, 
+    matcher: StaticMatcher, 
+    kps_0: tuple[cv.KeyPoint], 
+    frame_gry: NDArray[np.uint8],
+    scale: float = 1.0,
+    max_keypoints: int | None = None,
+    native_shape: tuple[int, int] | None = None,
+) -> tuple[NDArray, bool, NDArray]:
+    """ matches one sub-frame to the static frame and estimates the homography between them. returns the homography, an error flag and the inlier points (in static frame coordinates). When processing at a smaller scale, the keypoints of the static frame have to be detected at the same scale. The homography and the inliers are always returned in native pixel coordinates. The frame can also be given at processing scale already (downscaled while decoding), native_shape is the shape of the original frame then. """
     
-    return static_frame
+    # downscale the frame for processing (unless it was already downscaled while decoding)
+    native_shape = frame_gry.shape if native_shape is None else native_shape
+    if scale < 1:
+        S = proc_scale_matrix(native_shape, scale)
+        if frame_gry.shape == native_shape:
+            frame_gry = downscale_frame(frame_gry, scale)
+    
+    # keypoint detection on current frame
+    kps_f, dsc_f = detect_features(detector, frame_gry, max_keypoints)
+    
+    if len(kps_f) == 0:
+        # no keypoints, no homography
+        return np.zeros((3, 3)), True, np.zeros((0, 2), dtype=np.float32)
+    
+    # match with keypoints from static frame
+    matches = matcher.match(dsc_f)
+    
+    if len(matches) < max(4, MIN_MATCHES_HO):
+        # few matches, potentially no good homography
+        return np.zeros((3, 3)), True, np.zeros((0, 2), dtype=np.float32)
+    
+    # extract only the (x, y) points from the keypoints
+    p_0 = np.float32([kps_0[i0].pt for _, i0, _ in matches]).reshape(-1, 1, 2)
+    p_f = np.float32([kps_f[iF].pt for _, _, iF in matches]).reshape(-1, 1, 2)
+    
+    # estimate homography (needs min 4 points)
+    with profiled("ransac"):
+        HO, mask = cv.findHomography(p_0, p_f, cv.RANSAC, RANSAC_REPROJ_THRESH_HO)
+    
+    if HO is None:
+        # if ho estimation fails, cv2 returns None
+        return np.zeros((3, 3)), True, np.zeros((0, 2), dtype=np.float32)
+    
+    inliers = p_0.reshape(-1, 2)[mask.squeeze().astype(bool)]
+    
+    # rescale to native pixels: x_proc = S @ x_native, so HO_native = S^-1 @ HO_proc @ S
+    if scale < 1:
+        HO = np.linalg.inv(S) @ HO @ S
+        inliers = ((inliers - S[0:2, 2]) / np.diag(S)[0:2]).astype(np.float32)
+    
+    # good homography was found
+    return HO, False, inliers
 
-def calculate_movements(CLIARGS: CLIArgs, video: VideoContainer, static_frame: NDArray[np.uint8], fidx: list[int]):
+def aggregate_main_steps(video: VideoContainer, step_results: list[list[tuple]]) -> list[tuple[float, float, bool]]:
+    """ combines the homographies of all sub-frames around each main step into one robust movement estimate per main step. All homographies of the video are evaluated in one call and the main modes of all steps are estimated at once (main_mode_kde_batched). returns movement, agreement and error flag for each main step. """
+    
+    if len(step_results) == 0:
+        return []
+    
+    # evaluate homographies on a grid of points
+    ho_arrays = np.stack([r[0] for res in step_results for r in res])
+    mag_means, _ = evaluate_homographies(ho_arrays, (video.H, video.W), resolution=HO_GRID_RES)
+    
+    # [n_steps, n_sub-frames] matrix of mean magnitudes. if ANY of the homographies of a step are erroneous, no motion can be estimated for this step (the whole row is masked with NaN)
+    mag_matrix = np.full((len(step_results), max(len(res) for res in step_results)), np.nan)
+    step_error = np.zeros(len(step_results), dtype=bool)
+    start = 0
+    for st, res in enumerate(step_results):
+        step_error[st] = any(r[1] is True for r in res)
+        if not step_error[st]:
+            mag_matrix[st, 0:len(res)] = mag_means[start:start+len(res)]
+        start += len(res)
+    
+    # estimate the main mode value and the "agreement" between the individual points (for all steps at once)
+    main_modes, main_mode_agreements = main_mode_kde_batched(mag_matrix, bandwidth=BW_MAIN_MODE)
+    
+    # if the points are randomly scattered the agreement will be low and this frame should be ignored (has to be NaN for plotly to recognize and hide it)
+    aggregates = []
+    for error, main_mode, main_mode_agreement in zip(step_error, main_modes, main_mode_agreements):
+        if error or not (main_mode_agreement >= AGREEMENT_THRESH):
+            aggregates.append((np.nan, np.nan, True))
+        else:
+            aggregates.append((main_mode, main_mode_agreement, False))
+    
+    return aggregates
+
+def aggregate_main_step(
+    video: VideoContainer, 
+    ho_arrays: list[NDArray], 
+    ho_errors: list[bool],
+) -> tuple[float, float, bool]:
+    """ combines the homographies of all sub-frames around one main step into one robust movement estimate (see aggregate_main_steps). returns movement, agreement and error flag. """
+    
+    return aggregate_main_steps(video, [list(zip(ho_arrays, ho_errors))])[0]
+
+def evaluate_main_steps(
+    CLIARGS: CLIArgs, 
+    video: VideoContainer, 
+    kps_0: tuple[cv.KeyPoint], 
+    dsc_0: NDArray, 
+    fidx: NDArray, 
+    scale: float,
+    desc: str,
+) -> list[list[tuple[NDArray, bool, NDArray]]]:
+    """ evaluates all sub-frames (fidx, shape [n_steps, N_SUBFR]) against the static frame keypoints. returns the sub-frame results grouped per main step. The sub-frames of a main step are evaluated in temporal order up to the first failed one (or, with early_agreement, up to the first ones that agree), so a step can have less than N_SUBFR results. """
+    
+    # serial mode: evaluate right away (wrapped in a future, so that both modes can be handled the same way)
+    detector = CLIARGS.detector.instantiate() # instantiates detector obj
+    matcher = StaticMatcher(CLIARGS.matcher, dsc_0, ratio=CLIARGS.match_ratio) # instantiates (and trains) matcher obj
+    
+    def _submit_serial(frame_gry: NDArray[np.uint8]) -> Future:
+        fut = Future()
+        fut.set_result(evaluate_subframe(
+            detector, matcher, kps_0, frame_gry, scale, CLIARGS.max_keypoints, native_shape=(video.H, video.W)
+        ))
+        return fut
+    
+    # threaded mode: the heavy cv2 calls release the GIL, so the workers run truly in parallel. every worker thread owns its own detector and matcher instances.
+    local = threading.local()
+    
+    def _init_thread() -> None:
+        local.detector = CLIARGS.detector.instantiate()
+        local.matcher = StaticMatcher(CLIARGS.matcher, dsc_0, ratio=CLIARGS.match_ratio)
+    
+    def _evaluate_subframe_threaded(frame_gry: NDArray[np.uint8]) -> tuple[NDArray, bool, NDArray]:
+        return evaluate_subframe(
+            local.detector, local.matcher, kps_0, frame_gry, scale, CLIARGS.max_keypoints, native_shape=(video.H, video.W)
+        )
+    
+    # all sub-frames are decoded in one forward pass (in this thread, the capture is not thread safe). frames shared by multiple main steps (overlapping sub-frame windows) are only decoded and evaluated once. since the main steps are sorted, they are completed in order.
+    last_idx = fidx.max(axis=1) # a main step is fully submitted once its last sub-frame was decoded
+    last_use = {fi: st for st, row in enumerate(fidx) for fi in row} # last main step that needs a certain frame
+    users = {} # frame index -> all main steps that need it (and its position among the sub-frames of the step)
+    for st, row in enumerate(fidx):
+        for k, fi in enumerate(row):
+            users.setdefault(fi, []).append((st, k))
+    
+    step_results = []
+    submitted = {} # frame index -> future of the sub-frame result
+    pending = deque() # main steps that are fully submitted but not yet finished
+    step_next = 0
+    
+    # early exit: a main step is cut at its first failed sub-frame (it is an error anyways) or as soon as its first early_agreement sub-frames agree. The cut only depends on the sub-frames before it, so serial and threaded mode evaluate the same sub-frames. frames that are only needed by cut steps are not decoded at all. In threaded mode, the sub-frames before it may still be evaluated when deciding on a sub-frame: where the step can be cut by agreement, the decision waits for all of them. Elsewhere (only a failure can cut the step), it waits for all but the last threads-1 of them, so that the workers stay busy and at most threads-1 sub-frames per step are decoded beyond a failure.
+    magnitudes = {} # frame index -> mean movement magnitude of the sub-frame
+    cuts = {} # main step -> number of sub-frames up to the cut
+    
+    def _wait(k: int) -> int:
+        # number of sub-frames to wait for before deciding on the sub-frame at position k of a step
+        if CLIARGS.early_agreement is not None and k >= CLIARGS.early_agreement:
+            return k
+        return k - (CLIARGS.threads - 1)
+    
+    def _find_cut(st: int, wait: int) -> int | None:
+        # the first wait sub-frames are waited for, later sub-frames that are still being evaluated count as unknown (no cut yet)
+        for n, fi in enumerate(fidx[st], start=1):
+            fut = submitted.get(fi)
+            if fut is None or (n > wait and fut.done() is False):
+                return None
+            ho, error, _ = fut.result()
+            if error is True:
+                return n
+            if CLIARGS.early_agreement is None:
+                continue
+            if fi not in magnitudes:
+                magnitudes[fi] = evaluate_homographies(ho[None], (video.H, video.W), resolution=HO_GRID_RES)[0][0]
+            if n >= CLIARGS.early_agreement:
+                _, agreement = main_mode_kde(np.array([magnitudes[f] for f in fidx[st][0:n]]), bandwidth=BW_MAIN_MODE)
+                if agreement >= EARLY_AGREEMENT_THRESH:
+                    return n
+        return None
+    
+    def _skip(fi: int) -> bool:
+        for st, k in users[fi]:
+            if st not in cuts:
+                cut = _find_cut(st, wait=_wait(k))
+                if cut is None:
+                    return False
+                cuts[st] = cut
+        return True
+    
+    plan = FramePlan(
+        video.path, fidx.ravel(), seek_cost=SEEK_COST_FRAMES, keyframes=video.keyframes, skip=_skip, 
+        open_source=frame_source(CLIARGS), scale=scale, # (sub-frames are decoded at processing scale)
+    )
+    
+    pool = ThreadPoolExecutor(max_workers=CLIARGS.threads, initializer=_init_thread) if CLIARGS.threads > 1 else None
+    submit = _submit_serial if pool is None else (lambda frame_gry: pool.submit(_evaluate_subframe_threaded, frame_gry))
+    progress = pbar(total=len(fidx), desc=desc, position=1, leave=False)
+    
+    def _finish_pending() -> None:
+        st = pending.popleft()
+        cut = cuts.get(st) or _find_cut(st, wait=len(fidx[st])) or len(fidx[st])
+        step_results.append([submitted[fi].result() for fi in fidx[st][0:cut]])
+        for fi in fidx[st]: # drop results that are not needed by any later main step
+            if last_use[fi] == st:
+                submitted.pop(fi, None)
+                magnitudes.pop(fi, None)
+        progress.update(1)
+    
+    try:
+        for fi, frame_gry in plan:
+            submitted[fi] = submit(frame_gry)
+            while step_next < len(fidx) and last_idx[step_next] <= fi:
+                pending.append(step_next)
+                step_next += 1
+            # main steps in flight are bounded, so that decoded frames do not pile up in memory
+            while len(pending) > CLIARGS.threads - 1:
+                _finish_pending()
+        pending.extend(range(step_next, len(fidx))) # steps whose last sub-frames were skipped
+        while len(pending) > 0:
+            _finish_pending()
+    finally:
+        progress.close()
+        if pool is not None:
+            pool.shutdown()
+    
+    return step_results
+
+def detect_static_features(CLIARGS: CLIArgs, video: VideoContainer, static_frame: NDArray[np.uint8]):
     
-    # setup ------------------------------------------------------------------------------------------------------------
     detector = CLIARGS.detector.instantiate() # instantiates detector obj
-    matcher = CLIARGS.matcher.instantiate() # instantiates matcher obj
+    scale = resolve_proc_scale(CLIARGS, video)
     
-    # static frame -----------------------------------------------------------------------------------------------------
-    kps_0, dsc_0 = detector.detectAndCompute(static_frame, None) # keypoints of static reference frame
+    kps_0, dsc_0 = detect_features(detector, downscale_frame(static_frame, scale), CLIARGS.max_keypoints) # keypoints of static frame
     
     if len(kps_0) == 0:
         raise ValueError(f"did not detect ANY keypoints in the init frame of {video.name}!")
     
+    return kps_0, dsc_0
+
+@profile("reference")
+def generate_reference(CLIARGS: CLIArgs, video: VideoContainer, fidx: NDArray):
+    """ returns the static reference frame and its keypoints and descriptors (at processing scale). If a cache directory is given, the reference is only computed once for a given video, static window and reference settings. """
+    
+    if CLIARGS.cache_dir is None:
+        static_frame = generate_static_frame(CLIARGS, video, fidx)
+        return static_frame, *detect_static_features(CLIARGS, video, static_frame)
+    
+    cache = ReferenceCache(CLIARGS.cache_dir, max_bytes=REF_CACHE_MAX_MB*1e6)
+    key = hash_key({
+        "video": video_identity(video.path),
+        "static_window": list(video.static_window),
+        "decode_backend": CLIARGS.decode_backend.name,
+        "decode_luma": CLIARGS.decode_luma,
+        "n_init_steps": CLIARGS.n_init_steps,
+        "init_frame_blending": CLIARGS.init_frame_blending.name,
+        "blend_native_res": CLIARGS.blend_native_res,
+        "blend_mem_budget_mb": BLEND_MEM_BUDGET_MB, # (limits the blending resolution)
+        "detector": CLIARGS.detector.name,
+        "max_keypoints": CLIARGS.max_keypoints,
+        "proc_scale": resolve_proc_scale(CLIARGS, video),
+    })
+    
+    cached = cache.load(key)
+    if cached is not None:
+        return cached
+    
+    static_frame = generate_static_frame(CLIARGS, video, fidx)
+    kps_0, dsc_0 = detect_static_features(CLIARGS, video, static_frame)
+    cache.store(key, static_frame, kps_0, dsc_0)
+    
+    return static_frame, kps_0, dsc_0
+
+def estimate_steps(
+    CLIARGS: CLIArgs, 
+    video: VideoContainer, 
+    static_frame: NDArray[np.uint8], 
+    kps_0: tuple[cv.KeyPoint], 
+    dsc_0: NDArray, 
+    fidx: NDArray,
+    scale: float,
+    desc: str,
+) -> tuple[list, list]:
+    """ evaluates and aggregates a set of main steps (sub-frame indices fidx, shape [n, N_SUBFR]). returns the sub-frame results and the (movement, agreement, error) of every step. """
+    
+    step_results = evaluate_main_steps(CLIARGS, video, kps_0, dsc_0, fidx, scale, desc=desc)
+    step_aggregates = aggregate_main_steps(video, step_results)
+    
+    # coarse-to-fine: only the ambiguous main steps (failed or low agreement) are evaluated again at full resolution
+    if scale < 1 and CLIARGS.refine_full_res is True:
+        ambiguous = [st for st, (_, _, error) in enumerate(step_aggregates) if error is True]
+        if len(ambiguous) > 0:
+            kps_0, dsc_0 = detect_features(CLIARGS.detector.instantiate(), static_frame, CLIARGS.max_keypoints)
+            refined = evaluate_main_steps(
+                CLIARGS, video, kps_0, dsc_0, fidx[ambiguous], 1.0, desc=f"refining {video.name}"
+            )
+            for st, res, agg in zip(ambiguous, refined, aggregate_main_steps(video, refined)):
+                step_results[st] = res
+                step_aggregates[st] = agg
+    
+    return step_results, step_aggregates
+
+def bisect_steps(
+    fidx_main: NDArray, 
+    movements: list[float], 
+    errors: list[bool], 
+    thresh: float, 
+    resolution: float,
+) -> NDArray[np.int64]:
+    """ one round of adaptive sampling: frame indices of new main steps. Wherever the movements of two consecutive good steps differ by more than thresh, every interval between the sampled steps in this span (failed steps included) that is longer than resolution frames is split in half. fidx_main has to be sorted. """
+    
+    good = np.flatnonzero(~np.asarray(errors, dtype=bool))
+    fidx_new = []
+    for a, b in zip(good[:-1], good[1:]):
+        if abs(movements[b] - movements[a]) > thresh:
+            for i in range(a, b):
+                if fidx_main[i+1] - fidx_main[i] > max(resolution, 1):
+                    fidx_new.append((fidx_main[i] + fidx_main[i+1]) // 2)
+    
+    return np.unique(np.array(fidx_new, dtype=np.int64))
+
+@profile("movements")
+def calculate_movements(
+    CLIARGS: CLIArgs, 
+    video: VideoContainer, 
+    static_frame: NDArray[np.uint8], 
+    kps_0: tuple[cv.KeyPoint], 
+    dsc_0: NDArray, 
+    fidx: NDArray,
+):
+    """ estimates the movement relative to the static frame (with keypoints and descriptors at processing scale) for each main step. fidx holds the frame indices of all sub-frames around each main step (shape [n_main_steps, N_SUBFR]). With adaptive sampling, more steps are added where the movement changes, so the sub-frame indices of all evaluated steps (sorted by time) are returned along with the results. The number of evaluated sub-frames per step shows the work saved by the early exit. """
+    
+    # setup ------------------------------------------------------------------------------------------------------------
+    scale = resolve_proc_scale(CLIARGS, video)
+    
     # loop trough MAIN-FRAMES of video ---------------------------------------------------------------------------------
+    step_results, step_aggregates = estimate_steps(
+        CLIARGS, video, static_frame, kps_0, dsc_0, fidx, scale, desc=f"movements of {video.name}"
+    )
+    
+    # adaptive sampling: the coarse grid is bisected recursively, but only where the movement changes ------------------
+    if CLIARGS.adaptive_thresh is not None:
+        while True:
+            fidx_main = fidx[:, N_SUBFR//2]
+            fidx_new = subframe_indices(CLIARGS, video, bisect_steps(
+                fidx_main, 
+                [agg[0] for agg in step_aggregates], 
+                [agg[2] for agg in step_aggregates], 
+                CLIARGS.adaptive_thresh, 
+                CLIARGS.adaptive_resolution * video.fpsc,
+            ))
+            fidx_new = fidx_new[~np.isin(fidx_new[:, N_SUBFR//2], fidx_main)] # (snapping to keyframes can hit old steps)
+            if len(fidx_new) == 0:
+                break
+            
+            results_new, aggregates_new = estimate_steps(
+                CLIARGS, video, static_frame, kps_0, dsc_0, fidx_new, scale, desc=f"bisecting {video.name}"
+            )
+            order = np.argsort(np.concatenate([fidx_main, fidx_new[:, N_SUBFR//2]]), kind="stable")
+            fidx = np.concatenate([fidx, fidx_new])[order]
+            step_results = [(step_results + results_new)[i] for i in order]
+            step_aggregates = [(step_aggregates + aggregates_new)[i] for i in order]
+    
+    # collect results --------------------------------------------------------------------------------------------------
     movements = []
     agreements = []
     errors = []
-    detections = []
+    subframes = []
+    detections = GrowableArray(n_cols=3, dtype=np.float32) # [main step, x, y] of the inliers of all good steps
+    for st, (res, (movement, agreement, error)) in enumerate(zip(step_results, step_aggregates)):
+        movements.append(movement)
+        agreements.append(agreement)
+        errors.append(error)
+        subframes.append(len(res))
+        if error is False:
+            for r in res:
+                detections.append(np.concatenate([np.full((len(r[2]), 1), st, dtype=np.float32), r[2]], axis=1))
     
-    cap = cv.VideoCapture(video.path)
-    for fi in pbar(fidx, desc=f"movements of {video.name}", position=1, leave=False):
-        
-        # go through SUB-FRAMES around each main frame -------------------------
-        # go through a few frames around the main one and match their keypoints to the static frame. record HOs
-        ho_arrays_temp = []
-        ho_errors_temp = []
-        ho_detect_temp = []
-        
-        for ri in np.linspace(-T_SUBFR*video.fpsc, T_SUBFR*video.fpsc, N_SUBFR, dtype=int): 
-        
-            # read a single frame
-            frame_gry = get_video_frame_gry(cap, fi+ri)
-            
-            # keypoint detection on current frame
-            kps_f, dsc_f = detector.detectAndCompute(frame_gry, None)
-            
-            if len(kps_f) == 0:
-                # no keypoints, no homography
-                ho_arrays_temp.append(np.zeros((3, 3)))
-                ho_errors_temp.append(True)
-                continue
-            
-            # match with keypoints from static frame
-            matches = matcher.match(dsc_0, dsc_f)
-            matches = sorted(matches, key=lambda x: x.distance) # sort by descriptor distance (better match first)
-            
-            if len(matches) < max(4, MIN_MATCHES_HO):
-                # few matches, potentially no good homography
-                ho_arrays_temp.append(np.zeros((3, 3)))
-                ho_errors_temp.append(True)
-                continue
-            
-            # extract only the (x, y) points from the keypoints
-            p_0 = np.float32([kps_0[ma.queryIdx].pt for ma in matches]).reshape(-1, 1, 2) # queryIdx -> dumb cv2 syntax
-            p_f = np.float32([kps_f[ma.trainIdx].pt for ma in matches]).reshape(-1, 1, 2) # trainIdx -> dumb cv2 syntax
-            
-            # estimate homography (needs min 4 points)
-            HO, mask = cv.findHomography(p_0, p_f, cv.RANSAC, RANSAC_REPROJ_THRESH_HO)
-            
-            if HO is None:
-                # if ho estimation fails, cv2 returns None
-                ho_arrays_temp.append(np.zeros((3, 3)))
-                ho_errors_temp.append(True)
-                continue
-            
-            # store if good homography was found
-            ho_arrays_temp.append(HO)
-            ho_errors_temp.append(False)
-            ho_detect_temp.extend(list(p_0.squeeze()[mask.squeeze().astype(bool)]))
-
-        # if ANY of the homographies are erroneous -----------------------------
-        # no motion can be estimated in this case
-        if np.any([err is True for err in ho_errors_temp]) is True:
-            movements.append(np.nan) # has to be NaN for plotly to recognize and hide it
-            agreements.append(np.nan) # has to be NaN for plotly to recognize and hide it
-            errors.append(True)
-        
-        # if all homographies are successful -----------------------------------
-        else:
-            # evaluate homographies on a grid of points
-            mag_means = []
-            for ho in ho_arrays_temp:
-                mean_mag, avg_vec = evaluate_homography(ho, (video.H, video.W), resolution=HO_GRID_RES)
-                mag_means.append(mean_mag)
-            mag_means = np.array(mag_means)
-            
-            # estimate the main mode value and the "agreement" between the individual points
-            main_mode, main_mode_agreement = main_mode_kde(mag_means, bandwidth=BW_MAIN_MODE)
-            
-            # if the points are randomly scattered the agreement will be low and this frame should be ignored
-            if main_mode_agreement < AGREEMENT_THRESH:
-                movements.append(np.nan) # has to be NaN for plotly to recognize and hide it
-                agreements.append(np.nan) # has to be NaN for plotly to recognize and hide it
-                errors.append(True) 
-             
-            # if the multiple sub-frames around the main frame have at least somewhat similar values, then the agreement will be higher and the estimation can be used   
-            else:
-                movements.append(main_mode)
-                agreements.append(main_mode_agreement)
-                errors.append(False)
-                detections.extend(ho_detect_temp)
-    
-    # not doing this can cause problems in rare cases       
-    cap.release()
-    
-    return movements, agreements, errors, detections
+    return fidx, movements, agreements, errors, subframes, detections.array()
 
-def process_video(CLIARGS: CLIArgs, video: VideoContainer) -> None:
+def processing_spec(CLIARGS: CLIArgs, video: VideoContainer) -> dict:
+    """ everything that influences the results of process_video for one video (used to detect outdated results). """
+    
+    return {
+        "video": video_identity(video.path),
+        "static_window": list(video.static_window),
+        "decode_backend": CLIARGS.decode_backend.name, # (the gray conversion differs slightly)
+        "decode_luma": CLIARGS.decode_luma, # (same)
+        "n_init_steps": CLIARGS.n_init_steps,
+        "init_frame_blending": CLIARGS.init_frame_blending.name,
+        "blend_native_res": CLIARGS.blend_native_res,
+        "n_main_steps": CLIARGS.n_main_steps,
+        "adaptive_thresh": CLIARGS.adaptive_thresh,
+        "adaptive_resolution": CLIARGS.adaptive_resolution,
+        "early_agreement": CLIARGS.early_agreement,
+        "detector": CLIARGS.detector.name,
+        "max_keypoints": CLIARGS.max_keypoints,
+        "matcher": CLIARGS.matcher.name,
+        "match_ratio": CLIARGS.match_ratio,
+        "proc_scale": resolve_proc_scale(CLIARGS, video),
+        "refine_full_res": CLIARGS.refine_full_res,
+        "snap_keyframes": CLIARGS.snap_keyframes,
+        "format": RESULT_STORE_FORMAT,
+        "config": [MIN_MATCHES_HO, RANSAC_REPROJ_THRESH_HO, N_SUBFR, T_SUBFR, HO_GRID_RES, BW_MAIN_MODE, AGREEMENT_THRESH, EARLY_AGREEMENT_THRESH, BLEND_MEM_BUDGET_MB, REFERENCE_THUMB_MAX_SIDE],
+    }
+
+def frame_indices(CLIARGS: CLIArgs, video: VideoContainer) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """ frame indices of the init frames in the static window (shape [n_init_steps]) and of all sub-frames around each main step (shape [n_main_steps, N_SUBFR]). """
     # NOTE: cv2 has a bug where sometimes even the second last frame is not retrievable, so therefore the last frame index is padded by 2, to have some safety margin to not run into this problem.
     
     # setup the frame indices for the static window 
@@ -172,13 +604,46 @@ def process_video(CLIARGS: CLIArgs, video: VideoContainer) -> None:
         (video.ftot-2) - T_SUBFR*video.fpsc, 
         CLIARGS.n_main_steps
     ).astype(np.int64)
+    
+    # keyframes for snapping the sub-frames
+    if CLIARGS.snap_keyframes is True:
+        video.keyframes = load_keyframe_index(video.path)
+        video.keyframes = video.keyframes[video.keyframes <= video.ftot-2] # same safety margin as above
+    
+    return fidx_init, subframe_indices(CLIARGS, video, fidx_main)
 
-    # generate the reference frame by blending multiple images from the static window
-    static_frame = generate_static_frame(CLIARGS, video, fidx_init)
+def subframe_indices(CLIARGS: CLIArgs, video: VideoContainer, fidx_main: NDArray) -> NDArray[np.int64]:
+    """ frame indices of the sub-frames around each main step (shape [len(fidx_main), N_SUBFR]). """
     
-    # estimate the homography relative to the static frame for all other step in the whole video
-    video.movements, video.agreements, video.errors, video.detections = calculate_movements(
-        CLIARGS, video, static_frame, fidx_main
-    )
+    # the sub-frame indices around each main step [n_main_steps, N_SUBFR]
+    fidx_sub = fidx_main[:, None] + np.linspace(-T_SUBFR*video.fpsc, T_SUBFR*video.fpsc, N_SUBFR, dtype=int)[None, :]
+    
+    # optionally move main and sub-frames onto keyframes (movement detection does not care about some jitter in time)
+    if CLIARGS.snap_keyframes is True:
+        fidx_sub = snap_to_keyframes(fidx_sub, video.keyframes, tolerance=KEYFRAME_SNAP_TOL*video.fpsc)
+    
+    return fidx_sub.astype(np.int64)
+
+def process_video(CLIARGS: CLIArgs, video: VideoContainer) -> None:
+    
+    # with --profile, all instrumented stages (decoding, detection, matching, ...) are recorded into video.profile
+    with collect_profile(video.profile, enabled=CLIARGS.profile), profiled("process_video"):
+        
+        # frame indices of the static window and of the sub-frames around each main step
+        fidx_init, fidx_sub = frame_indices(CLIARGS, video)
+
+        # generate the reference frame by blending multiple images from the static window (or load it from the cache)
+        static_frame, kps_0, dsc_0 = generate_reference(CLIARGS, video, fidx_init)
+        
+        # estimate the homography relative to the static frame for all other step in the whole video
+        fidx_sub, video.movements, video.agreements, video.errors, video.subframes, video.detections = calculate_movements(
+            CLIARGS, video, static_frame, kps_0, dsc_0, fidx_sub
+        )
+        
+        # time [s] of each main step (its center sub-frame)
+        video.timestamps = list(fidx_sub[:, N_SUBFR//2] / video.fpsc)
+        
+        # small copy of the reference frame, so that the heatmap can be rendered later (also from stored results)
+        video.reference = downscale_frame(static_frame, min(1.0, REFERENCE_THUMB_MAX_SIDE / max(static_frame.shape[0:2])))
     
     
\ No newline at end of file
@@ -0,0 +1,232 @@
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+import tyro
+from numpy.typing import NDArray
+
+from ..config.coreconfig import (
+    N_SUBFR,
+    PROC_AUTO_MAX_SIDE,
+    T_SUBFR,
+    InitFrameBlending,
+    KeypointDetector,
+    KeypointMatcher,
+)
+from ..util.util import sec_2_tstr
+from ..util.video import downscale_frame
+from .containers import VideoContainer
+from .processing import StaticMatcher, aggregate_main_step, detect_features, evaluate_subframe
+
+
+@dataclass
+class StreamTick:
+
+    time: float # [s] since the start of the stream
+    movement: float
+    agreement: float
+    error: bool
+    event: bool # True when the movement just exceeded the threshold (rising edge, not on every tick above it)
+
+def iter_capture_frames(source: str | int, realtime: bool = False) -> Iterator[tuple[float, NDArray[np.uint8]]]:
+    """ yields (timestamp [s], grayscale frame) from any cv2 capture source (camera index, stream url or video file). Files are timestamped by their frame index, live sources by wall time. With realtime=True, a file is replayed at its actual framerate (stand-in for a live camera). """
+
+    cap = cv.VideoCapture(source)
+    if cap.isOpened() is False:
+        raise ValueError(f"could not open capture source! (got {source})")
+
+    is_file = isinstance(source, str | Path) and Path(source).is_file()
+    fps = cap.get(cv.CAP_PROP_FPS)
+    t_start = time.monotonic()
+    fi = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if ret is False:
+                return # end of file or stream closed
+
+            if is_file:
+                t = fi / fps
+                if realtime is True:
+                    time.sleep(max(0.0, t - (time.monotonic() - t_start)))
+            else:
+                t = time.monotonic() - t_start
+            fi += 1
+
+            yield t, cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    finally:
+        cap.release()
+
+class StreamAnalyzer:
+    """ online camera movement analysis on a (possibly endless) stream of frames. The reference is built once from n_init_steps frames spread over the first init_duration seconds. Afterwards, one sub-frame is sampled every 2*T_SUBFR/(N_SUBFR-1) seconds and immediately matched against the reference, only the results of the last N_SUBFR sub-frames are kept (bounded memory). Every tick_interval seconds, these are combined into one robust estimate (main_mode_kde), exactly like one main step in process_video. """
+
+    def __init__(
+        self,
+        init_duration: float,
+        tick_interval: float,
+        move_thresh: float,
+        n_init_steps: int = 8,
+        init_frame_blending: InitFrameBlending = InitFrameBlending.KDE,
+        detector: KeypointDetector = KeypointDetector.AKAZE,
+        matcher: KeypointMatcher = KeypointMatcher.BF_NORM_HAMM,
+        match_ratio: float | None = None,
+        max_keypoints: int | None = None,
+        proc_scale: float | None = 1.0,
+        on_event: Callable[[StreamTick], None] | None = None,
+    ):
+        self.init_duration = init_duration
+        self.tick_interval = tick_interval
+        self.move_thresh = move_thresh
+        self.n_init_steps = n_init_steps
+        self.init_frame_blending = init_frame_blending
+        self.proc_scale = proc_scale
+        self.on_event = on_event
+
+        self.detector = detector.instantiate()
+        self.matcher_kind = matcher
+        self.match_ratio = match_ratio
+        self.max_keypoints = max_keypoints
+
+        # init phase
+        self.init_times = list(np.linspace(0, init_duration, n_init_steps))
+        self.init_blending = init_frame_blending.accumulator(n_frames=n_init_steps) # frames are blended as they arrive
+
+        # analysis phase
+        self.video = None # VideoContainer describing the stream (needed for evaluating homographies)
+        self.scale = None
+        self.kps_0 = None
+        self.matcher = None # bound to the static frame descriptors once the reference is built
+        self.subfr_interval = 2*T_SUBFR / (N_SUBFR-1)
+        self.subfr_next = None
+        self.tick_next = None
+        self.results = deque(maxlen=N_SUBFR)
+        self.moved = False
+
+    @property
+    def ready(self) -> bool:
+        return self.kps_0 is not None
+
+    def _build_reference(self, t: float) -> None:
+
+        H, W = self.init_blending.shape
+        self.video = VideoContainer(path=Path("stream"), fpsc=0, ftot=0, H=H, W=W, static_window=(0, t))
+        self.scale = min(1.0, PROC_AUTO_MAX_SIDE / max(H, W)) if self.proc_scale is None else self.proc_scale
+
+        static_frame = self.init_blending.result()
+        self.init_blending = None # not needed anymore
+        self.kps_0, dsc_0 = detect_features(self.detector, downscale_frame(static_frame, self.scale), self.max_keypoints)
+        if len(self.kps_0) == 0:
+            raise ValueError("did not detect ANY keypoints in the init frame of the stream!")
+        self.matcher = StaticMatcher(self.matcher_kind, dsc_0, ratio=self.match_ratio)
+
+        self.subfr_next = t
+        self.tick_next = t + 2*T_SUBFR # first tick as soon as one full sub-frame window is available
+
+    def feed(self, t: float, frame_gry: NDArray[np.uint8]) -> StreamTick | None:
+        """ consumes one frame (timestamp [s], grayscale). returns a StreamTick whenever a new estimate is available. """
+
+        # init phase: collect frames for the reference ---------------------------------------------
+        if self.ready is False:
+            if len(self.init_times) > 0 and t >= self.init_times[0]:
+                self.init_blending.add(frame_gry)
+                self.init_times.pop(0)
+            if len(self.init_times) == 0:
+                self._build_reference(t)
+            return None
+
+        # analysis phase: sample sub-frames and evaluate them right away ---------------------------
+        if t >= self.subfr_next:
+            self.results.append(evaluate_subframe(
+                self.detector, self.matcher, self.kps_0, frame_gry, self.scale, self.max_keypoints
+            ))
+            self.subfr_next += self.subfr_interval
+
+        if t < self.tick_next or len(self.results) < N_SUBFR:
+            return None
+        self.tick_next += self.tick_interval
+
+        # tick: combine the last sub-frames into one robust estimate -------------------------------
+        movement, agreement, error = aggregate_main_step(
+            self.video, [res[0] for res in self.results], [res[1] for res in self.results]
+        )
+        moved = (error is False) and (movement > self.move_thresh)
+        tick = StreamTick(time=t, movement=movement, agreement=agreement, error=error, event=moved and not self.moved)
+        if error is False: # an error says nothing about whether the camera moved, so the state is kept
+            self.moved = moved
+
+        if tick.event is True and self.on_event is not None:
+            self.on_event(tick)
+
+        return tick
+
+    def run(self, frames: Iterable[tuple[float, NDArray[np.uint8]]]) -> Iterator[StreamTick]:
+        """ consumes (timestamp, frame) pairs from any iterable and yields the ticks. """
+
+        for t, frame_gry in frames:
+            tick = self.feed(t, frame_gry)
+            if tick is not None:
+                yield tick
+
+def run_stream(
+    source: str,
+    init_duration: float = 10.0,
+    tick_interval: float = 2.0,
+    move_thresh: float = 5.0,
+    realtime: bool = False,
+    n_init_steps: int = 8,
+    init_frame_blending: InitFrameBlending = InitFrameBlending.KDE,
+    detector: KeypointDetector = KeypointDetector.AKAZE,
+    matcher: KeypointMatcher = KeypointMatcher.BF_NORM_HAMM,
+    match_ratio: float | None = None,
+    max_keypoints: int | None = None,
+    proc_scale: float | None = 1.0,
+) -> None:
+    """ continuously watches a camera feed and reports camera movement relative to the first seconds of the stream.
+
+    Args:
+        source: camera index (e.g. 0), stream url or video file.
+        init_duration: length [s] of the initial window from which the reference frame is built. the camera has to be static in this window.
+        tick_interval: interval [s] between two movement estimates.
+        move_thresh: movement [px] above which a movement event is raised.
+        realtime: replay a video file at its actual framerate (stand-in for a live camera).
+        n_init_steps: number of frames (in the initial window) which are combined into the reference frame.
+        init_frame_blending: method for combining the initial frames to ideally remove moving elements.
+        detector: cv2 keypoint detector type.
+        matcher: cv2 keypoint matching type.
+        match_ratio: kNN ratio test threshold (None matches without ratio test).
+        max_keypoints: keypoint budget per frame, selected evenly over the image (None keeps all keypoints).
+        proc_scale: scale at which keypoints are detected and matched (None is automatic from the resolution).
+    """
+
+    source = int(source) if source.isdigit() else source
+
+    def _alert(tick: StreamTick) -> None:
+        print(f"[{sec_2_tstr(tick.time)}] MOVEMENT EVENT: camera moved by {tick.movement:.2f} px!")
+
+    analyzer = StreamAnalyzer(
+        init_duration=init_duration,
+        tick_interval=tick_interval,
+        move_thresh=move_thresh,
+        n_init_steps=n_init_steps,
+        init_frame_blending=init_frame_blending,
+        detector=detector,
+        matcher=matcher,
+        match_ratio=match_ratio,
+        max_keypoints=max_keypoints,
+        proc_scale=proc_scale,
+        on_event=_alert,
+    )
+
+    print(f"building reference from the first {init_duration} s of the stream...")
+    for tick in analyzer.run(iter_capture_frames(source, realtime=realtime)):
+        if tick.error is True:
+            print(f"[{sec_2_tstr(tick.time)}] movement: ----- px (no estimate)")
+        else:
+            print(f"[{sec_2_tstr(tick.time)}] movement: {tick.movement:5.2f} px (confidence {tick.agreement:.2f})")
+
+def main_stream(argv=None):
+    tyro.cli(run_stream, args=argv) # also calls the function!
@@ -0,0 +1,118 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import cv2 as cv
+import tyro
+
+from ..config.coreconfig import ALLOWED_VIDEO_EXT
+from ..config.plotconfig import PlotConfig
+from ..util.profiling import collect_profile, format_profile_table, profile_summary
+from ..util.util import json_2_dict
+from .batching import RESULT_STORE_DIR, init_worker, load_results, merge_results, process_video_worker, store_results
+from .caching import ResultStore, video_identity
+from .collecting import subcollect_single
+from .containers import VideoContainer, WatchArgs
+from .exporting import export_video
+from .plotting import plot_video
+from .writing import video_plot_path, write_heatmap
+
+
+def resolve_window(CLIARGS: WatchArgs, vid_path: Path) -> str | None:
+    """ static window string for one video. a json file is re-read every time, so that keys can be added while watching. returns None if there is no valid window (yet). """
+
+    if not Path(CLIARGS.static_window).is_file():
+        return CLIARGS.static_window
+
+    window = json_2_dict(Path(CLIARGS.static_window)).get(vid_path.name)
+    if window is None or WatchArgs._validate_window_str(window) is False:
+        return None
+    return window
+
+def write_video_plot(CLIARGS: WatchArgs, video: VideoContainer) -> None:
+    with collect_profile(video.profile, enabled=CLIARGS.profile):
+        [plot] = plot_video(CLIARGS, PlotConfig, video)
+    cv.imwrite(video_plot_path(CLIARGS, video), plot)
+
+def finish_video(CLIARGS: WatchArgs, store: ResultStore, video: VideoContainer, fut: Future) -> None:
+    try:
+        merge_results(video, fut.result())
+    except Exception as err:
+        print(f"processing {video.name} failed: {err}")
+        return
+    store_results(store, CLIARGS, video)
+    write_video_plot(CLIARGS, video)
+    write_heatmap(CLIARGS, video)
+    export_video(CLIARGS, video)
+    print(f"done with {video.name}")
+    if CLIARGS.profile is True:
+        print(format_profile_table(profile_summary([video.profile])))
+
+def watch_folder(CLIARGS: WatchArgs) -> None:
+    """ long-lived loop that processes videos as soon as they land in the input folder. A video is only picked up once its size did not change for a few polls (fully written). The worker pool stays warm over the whole session, results and plots are written per video. """
+
+    store = ResultStore(CLIARGS.output_path/RESULT_STORE_DIR)
+    sizes = {} # path -> (last size, number of polls with unchanged size)
+    handled = {} # path -> video identity when it was handled (processed, skipped or failed), retried if it changes
+    running = {} # future -> VideoContainer
+
+    print(f"watching {CLIARGS.input_path} for new videos (ctrl+c to stop)...")
+    pool = ProcessPoolExecutor(max_workers=CLIARGS.workers, initializer=init_worker)
+    try:
+        while True:
+
+            # check folder for new, fully written videos ---------------------------------------------------------------
+            vid_paths = [Path(vd) for xt in ALLOWED_VIDEO_EXT for vd in CLIARGS.input_path.glob(f"*{xt}")]
+            in_flight = {vd.path for vd in running.values()}
+            for vid_path in vid_paths:
+                try:
+                    identity = video_identity(vid_path)
+                except OSError:
+                    continue # deleted in the meantime
+                if vid_path in in_flight or handled.get(vid_path) == identity:
+                    continue
+
+                last_size, n_stable = sizes.get(vid_path, (None, 0))
+                n_stable = n_stable + 1 if identity["size"] == last_size else 0
+                sizes[vid_path] = (identity["size"], n_stable)
+                if n_stable < CLIARGS.stable_polls:
+                    continue # still being written
+
+                window = resolve_window(CLIARGS, vid_path)
+                if window is None:
+                    continue # no valid static window for this video yet, check again on the next poll
+
+                handled[vid_path] = identity
+                try:
+                    [video] = subcollect_single(vid_path, window, CLIARGS.decode_backend)
+                    video.sanitize(CLIARGS)
+                except (ValueError, ZeroDivisionError) as err:
+                    print(f"skipping {vid_path.name}: {err}")
+                    continue
+
+                if load_results(store, CLIARGS, video) is True:
+                    continue # already processed with the same parameters (e.g. in a previous session)
+
+                print(f"processing {video.name}...")
+                running[pool.submit(process_video_worker, CLIARGS, video)] = video
+
+            # collect finished videos and write their results and plots (until the next poll is due) -----------------
+            t_poll = time.monotonic() + CLIARGS.poll_interval
+            while time.monotonic() < t_poll:
+                if len(running) == 0:
+                    time.sleep(max(0.0, t_poll - time.monotonic()))
+                    break
+                timeout = max(0.0, t_poll - time.monotonic())
+                finished, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    finish_video(CLIARGS, store, running.pop(fut), fut)
+
+    except KeyboardInterrupt:
+        print("stopped watching.")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def main_watch(argv=None):
+    CLIARGS = tyro.cli(WatchArgs, args=argv)
+    CLIARGS.sanitize()
+    watch_folder(CLIARGS)
@@ -0,0 +1,129 @@
+import html
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+
+from ..config.coreconfig import OutputMode
+from ..config.plotconfig import PlotConfig
+from ..util.profiling import collect_profile, profile
+from .containers import CLIArgs, VideoContainer
+
+
+def video_plot_path(CLIARGS: CLIArgs, video: VideoContainer) -> Path:
+    return CLIARGS.output_path/f"{CLIARGS.plot_name}_{video.path.stem}.png"
+
+def heatmap_plot_path(CLIARGS: CLIArgs, video: VideoContainer) -> Path:
+    return CLIARGS.output_path/f"{CLIARGS.plot_name}_{video.path.stem}_heatmap.png"
+
+@profile("plot_heatmap")
+def render_heatmap(PCFG: PlotConfig, video: VideoContainer) -> NDArray[np.uint8]:
+    """ inlier density over the (downscaled) reference frame as BGR image. video.detections holds the [main step, x, y] of all inliers (native pixels). Regions without inliers show the plain reference frame, so it is visible which static regions carry the movement estimate. """
+    
+    H, W = video.reference.shape[0:2]
+    scale = W / video.W
+    
+    # inlier counts per pixel, smoothed into a density normalized to [0, 1]
+    density = np.histogram2d(
+        video.detections[:, 2] * scale, video.detections[:, 1] * scale, bins=(H, W), range=[[0, H], [0, W]]
+    )[0].astype(np.float32)
+    density = cv.GaussianBlur(density, (0, 0), sigmaX=PCFG.HEATMAP_SIGMA * max(H, W))
+    if density.max() > 0:
+        density /= density.max()
+    
+    colors = cv.applyColorMap((density * 255).astype(np.uint8), cv.COLORMAP_INFERNO)
+    alpha = (PCFG.HEATMAP_ALPHA * np.sqrt(density))[..., None] # sqrt: sparse regions are still visible
+    background = cv.cvtColor(video.reference, cv.COLOR_GRAY2BGR) if video.reference.ndim == 2 else video.reference
+    
+    return (background * (1 - alpha) + colors * alpha).astype(np.uint8)
+
+def write_heatmap(CLIARGS: CLIArgs, video: VideoContainer) -> None:
+    # the reference frame is only needed for the heatmap, so it does not pile up in memory over a large batch
+    if CLIARGS.heatmap is True and video.reference is not None:
+        with collect_profile(video.profile, enabled=CLIARGS.profile):
+            cv.imwrite(heatmap_plot_path(CLIARGS, video), render_heatmap(PlotConfig, video))
+    video.reference = None
+
+def page_plot_path(CLIARGS: CLIArgs, page: int) -> Path:
+    return CLIARGS.output_path/f"{CLIARGS.plot_name}_page_{page+1:03d}.png"
+
+class PlotWriter:
+    """ writes the plots of a batch of videos as soon as they are available (in any order). The plots always appear in the original order of the videos.
+
+    - STITCHED: one tall image with all plots (the plots are copied into one preallocated image, written at the end).
+    - PAGED: one image per page of page_size videos, written as soon as all videos of the page are plotted. Plots of incomplete pages are kept png encoded.
+    - PER_VIDEO: one image per video, written right away.
+
+    PAGED and PER_VIDEO additionally write an html index (<plot_name>_index.html) that lists all videos and their plot files. """
+
+    def __init__(self, CLIARGS: CLIArgs, videos: list[VideoContainer]):
+        self.CLIARGS = CLIARGS
+        self.slots = {id(vd): i for i, vd in enumerate(videos)} # position of each video in the batch
+        self.names = [vd.name for vd in videos]
+        self.files = [None] * len(videos) # plot file of each video (for the index)
+        self.stitched = None
+        self.pages = {} # page -> {slot in page: png encoded plot}
+
+    def _page_size(self, page: int) -> int:
+        return min(self.CLIARGS.page_size, len(self.names) - page*self.CLIARGS.page_size)
+
+    def add(self, video: VideoContainer, plot: NDArray[np.uint8]) -> None:
+
+        slot = self.slots[id(video)]
+        mode = self.CLIARGS.output_mode
+
+        if mode is OutputMode.STITCHED:
+            if self.stitched is None:
+                self.stitched = np.zeros((len(self.names)*plot.shape[0], *plot.shape[1:]), dtype=plot.dtype)
+            self.stitched[slot*plot.shape[0]:(slot+1)*plot.shape[0]] = plot
+
+        elif mode is OutputMode.PER_VIDEO:
+            self.files[slot] = video_plot_path(self.CLIARGS, video)
+            cv.imwrite(self.files[slot], plot)
+
+        elif mode is OutputMode.PAGED:
+            page, page_slot = divmod(slot, self.CLIARGS.page_size)
+            self.pages.setdefault(page, {})[page_slot] = cv.imencode(".png", plot)[1]
+            if len(self.pages[page]) == self._page_size(page):
+                self._write_page(page)
+
+    def _write_page(self, page: int) -> None:
+
+        encoded = self.pages.pop(page)
+        plots = [cv.imdecode(encoded[sl], cv.IMREAD_UNCHANGED) for sl in sorted(encoded)]
+        path = page_plot_path(self.CLIARGS, page)
+        cv.imwrite(path, np.concatenate(plots, axis=0))
+        for sl in encoded:
+            self.files[page*self.CLIARGS.page_size + sl] = path
+
+    def _write_index(self) -> None:
+
+        rows = []
+        for name, file in zip(self.names, self.files):
+            link = "no plot" if file is None else f"<a href=\"{html.escape(file.name)}\">{html.escape(file.name)}</a>"
+            rows.append(f"<tr><td>{html.escape(name)}</td><td>{link}</td></tr>")
+
+        # per video plots are shown inline, pages are only linked (they can be very tall)
+        images = []
+        if self.CLIARGS.output_mode is OutputMode.PER_VIDEO:
+            images = [f"<img src=\"{html.escape(fl.name)}\"><br>" for fl in self.files if fl is not None]
+
+        with open(self.CLIARGS.output_path/f"{self.CLIARGS.plot_name}_index.html", mode="w", encoding="utf-8") as file:
+            file.write("\n".join([
+                f"<html><head><meta charset=\"utf-8\"><title>{html.escape(self.CLIARGS.plot_name)}</title></head><body>",
+                "<table><tr><th>video</th><th>plot</th></tr>", *rows, "</table>", *images, "</body></html>",
+            ]))
+
+    def close(self) -> None:
+
+        if self.CLIARGS.output_mode is OutputMode.STITCHED:
+            if self.stitched is not None:
+                print("writing plot image...")
+                cv.imwrite(self.CLIARGS.output_path/f"{self.CLIARGS.plot_name}.png", self.stitched)
+            return
+
+        # pages with missing plots (failed videos) are written anyways
+        for page in sorted(self.pages):
+            self._write_page(page)
+        self._write_index()
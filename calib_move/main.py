@@ -1,14 +1,15 @@
-import cv2 as cv
-import einops as eo
-import numpy as np
+import time
+
 import tyro
 
 from .config.plotconfig import PlotConfig
+from .core.batching import process_videos
 from .core.collecting import collect_videos
-from .core.containers import CLIArgs
+from .core.containers import CLIArgs, VideoContainer
+from .core.exporting import export_batch, export_profile, export_video
 from .core.plotting import plot_video
-from .core.processing import process_video
-from .util.util import pbar
+from .core.writing import PlotWriter, write_heatmap
+from .util.profiling import collect_profile
 
 
 def main_func(argv=None):
@@ -23,30 +24,19 @@ def main_func(argv=None):
     for vd in videos:
         vd.sanitize(CLIARGS)
         
-    # process all videos to find homographies / movement ---------------------------------------------------------------
-    for vd in pbar(videos, desc="processing video(s)", position=0, leave=True):
-        process_video(CLIARGS, vd) # stores calculate average movement directly in VideoContainer
-        
-    # plot motion for all videos ---------------------------------------------------------------------------------------
-    plots = []
-    for vd in pbar(videos, desc="creating plot(s)", position=0, leave=True):
-        plots += plot_video(CLIARGS, PlotConfig, vd, )
-    
-    # stitch all plots together and save -------------------------------------------------------------------------------
-    plots_stitched = eo.rearrange(np.array(plots), "B h w c -> (B h) w c")
-    print("writing plot image...")
-    cv.imwrite(CLIARGS.output_path/f"{CLIARGS.plot_name}.png", plots_stitched)
-    
-
- 
-    
-
-    
-    
-    
-
-
-
-
-    
-    
+    # process all videos to find homographies / movement and plot each video as soon as it is done --------------------
+    t_start = time.perf_counter()
+    writer = PlotWriter(CLIARGS, videos)
+    def _video_done(vd: VideoContainer) -> None:
+        with collect_profile(vd.profile, enabled=CLIARGS.profile):
+            [plot] = plot_video(CLIARGS, PlotConfig, vd)
+        writer.add(vd, plot)
+        write_heatmap(CLIARGS, vd)
+        export_video(CLIARGS, vd)
+    
+    process_videos(CLIARGS, videos, on_done=_video_done) # stores calculate average movement directly in VideoContainers (serial or pool)
+    
+    # write remaining plots (stitched image, incomplete pages and index) and the batch export --------------------------
+    writer.close()
+    export_batch(CLIARGS, videos)
+    export_profile(CLIARGS, videos, wall=time.perf_counter() - t_start)
@@ -0,0 +1,245 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager
+from fractions import Fraction
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+
+try:
+    import av  # optional decode backend (pip install av)
+except ImportError:
+    av = None
+
+# maps limited range luma [16, 235] to full range gray [0, 255]. NOTE: this is not the same as the conversion to BGR and back to gray, which also depends on the chroma and on the clipping of the BGR values (a few gray values darker on average, more for saturated colors)
+LIMITED_2_FULL = np.clip(np.round((np.arange(256) - 16) * 255 / 219), 0, 255).astype(np.uint8)
+
+# 8 bit pixel formats whose first plane is the luma plane (cv2: fourcc of CAP_PROP_CODEC_PIXEL_FORMAT, PyAV: format name)
+LUMA_FOURCCS = {"I420", "IYUV", "YV12", "Y42B", "444P", "Y41B", "NV12", "NV21", "Y800", "GREY"}
+LUMA_FORMATS = {
+    "yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "yuv440p", "yuvj440p", "yuv411p", "yuv410p",
+    "nv12", "nv21", "gray",
+}
+
+# codecs that decode to full range luma (cv2 does not expose the color range, all other codecs are taken as limited)
+FULL_RANGE_CODECS = {"MJPG"}
+
+
+def downscale_frame(frame: NDArray, scale: float) -> NDArray:
+    """ downscales a frame by a factor (image size rounded to integer pixels). scale >= 1 returns the frame as is. """
+    
+    if scale >= 1:
+        return frame
+    H, W = frame.shape[0:2]
+    return cv.resize(frame, (round(W*scale), round(H*scale)), interpolation=cv.INTER_AREA)
+
+@contextmanager
+def quiet_cv() -> Iterator[None]:
+    # cv2 warns about the planar format on every luma frame, although the luma plane is exactly what is wanted
+    level = cv.utils.logging.getLogLevel()
+    cv.utils.logging.setLogLevel(cv.utils.logging.LOG_LEVEL_ERROR)
+    try:
+        yield
+    finally:
+        cv.utils.logging.setLogLevel(level)
+
+class FrameSource(ABC):
+    """ sequential access to the frames of a video file, independent of the decoding backend. The position is a frame index: seek(fidx) moves to a frame, grab() decodes the next frame without converting it (for skipping small gaps), read_gray() and read_bgr() decode and return the next frame. read_gray() returns the frame in gray, downscaled by scale. By default, it is converted to BGR and then to gray (cv.COLOR_BGR2GRAY). With luma_only, the fast path is used where the backend allows it: only the luma plane is taken from the decoder (no conversion to BGR and back) and the frame is downscaled while decoding. The gray values of both paths differ slightly (see LIMITED_2_FULL). The metadata (fps, n_frames, H, W) is read when opening. """
+
+    fps: float
+    n_frames: int
+    H: int
+    W: int
+
+    @abstractmethod
+    def __init__(self, path: Path, threads: int = 0, luma_only: bool = False):
+        ...
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    @abstractmethod
+    def seek(self, fidx: int) -> None:
+        ...
+
+    @abstractmethod
+    def grab(self) -> bool:
+        ...
+
+    @abstractmethod
+    def read_gray(self, scale: float = 1.0) -> NDArray[np.uint8] | None:
+        ...
+
+    @abstractmethod
+    def read_bgr(self) -> NDArray[np.uint8] | None:
+        ...
+
+    @abstractmethod
+    def release(self) -> None:
+        ...
+
+    def __enter__(self) -> "FrameSource":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+class OpenCVFrameSource(FrameSource):
+    """ cv2.VideoCapture (any backend that cv2 was built with). threads sets the number of decoding threads of the ffmpeg backend (0 leaves the default of cv2). With luma_only, for 8 bit planar yuv videos, the conversion to BGR is turned off for read_gray(): cv2 then passes on the first plane (luma) as a gray image. The conversion can only be switched before the first frame is retrieved, otherwise the capture is opened again at the current position. """
+
+    def __init__(self, path: Path, threads: int = 0, luma_only: bool = False):
+        self.path = path
+        self.params = [cv.CAP_PROP_N_THREADS, threads] if threads > 0 else []
+        self.cap = self._open()
+        self.fps = self.cap.get(cv.CAP_PROP_FPS)
+        self.n_frames = int(self.cap.get(cv.CAP_PROP_FRAME_COUNT))
+        self.H = int(self.cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+        self.W = int(self.cap.get(cv.CAP_PROP_FRAME_WIDTH))
+
+        self.luma = luma_only is True and self._fourcc(cv.CAP_PROP_CODEC_PIXEL_FORMAT) in LUMA_FOURCCS
+        self.full_range = self._fourcc(cv.CAP_PROP_FOURCC) in FULL_RANGE_CODECS
+        self.convert_rgb = True
+        self.retrieved = False # whether a frame was retrieved since opening
+        self.pos = 0 # index of the next frame
+
+    def _fourcc(self, prop: int) -> str:
+        return int(self.cap.get(prop)).to_bytes(4, "little", signed=True).decode("latin-1")
+
+    def _open(self) -> cv.VideoCapture:
+        cap = cv.VideoCapture(str(self.path), cv.CAP_ANY, self.params)
+        if cap.isOpened() is False:
+            raise ValueError(f"could not open video! (got {self.path})")
+        return cap
+
+    def _set_convert_rgb(self, convert_rgb: bool) -> None:
+        if convert_rgb == self.convert_rgb:
+            return
+        if self.retrieved is True:
+            self.cap.release()
+            self.cap = self._open()
+            self.retrieved = False
+            self.cap.set(cv.CAP_PROP_CONVERT_RGB, int(convert_rgb))
+            self.seek(self.pos)
+        else:
+            self.cap.set(cv.CAP_PROP_CONVERT_RGB, int(convert_rgb))
+        self.convert_rgb = convert_rgb
+
+    def seek(self, fidx: int) -> None:
+        self.cap.set(cv.CAP_PROP_POS_FRAMES, fidx)
+        self.pos = fidx
+
+    def grab(self) -> bool:
+        ret = self.cap.grab()
+        self.pos += 1
+        return ret
+
+    def read_gray(self, scale: float = 1.0) -> NDArray[np.uint8] | None:
+        if self.luma is False:
+            frame = self.read_bgr()
+            return None if frame is None else downscale_frame(cv.cvtColor(frame, cv.COLOR_BGR2GRAY), scale)
+
+        self._set_convert_rgb(False)
+        with quiet_cv():
+            ret, frame = self.cap.read()
+        self.pos += 1
+        self.retrieved = True
+        if ret is False:
+            return None
+        if frame.shape != (self.H, self.W): # not what was expected from the pixel format, always convert from now on
+            self.luma = False
+            self.seek(self.pos - 1)
+            return self.read_gray(scale)
+        frame = downscale_frame(frame, scale)
+        return frame if self.full_range is True else cv.LUT(frame, LIMITED_2_FULL)
+
+    def read_bgr(self) -> NDArray[np.uint8] | None:
+        self._set_convert_rgb(True)
+        ret, frame = self.cap.read()
+        self.pos += 1
+        self.retrieved = True
+        return frame if ret is True else None
+
+    def release(self) -> None:
+        # not doing this can cause problems in rare cases
+        self.cap.release()
+
+class PyAVFrameSource(FrameSource):
+    """ libav through PyAV. The codec decodes with frame and slice threads (threads = 0 uses one per core). A seek jumps to the keyframe before the timestamp of the frame and decodes forward up to exactly this frame. Frame indices and timestamps are converted with the average frame rate (constant frame rate, same as cv2). With luma_only, read_gray() returns the luma plane of the decoded frame without copying it (full range) or maps it to full range, downscaling is done by libswscale directly from the yuv frame. """
+
+    def __init__(self, path: Path, threads: int = 0, luma_only: bool = False):
+        if av is None:
+            raise ImportError("the PYAV decode backend needs PyAV! (pip install av)")
+        self.container = av.open(str(path))
+        if len(self.container.streams.video) == 0:
+            self.container.close()
+            raise ValueError(f"no video stream in file! (got {path})")
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.stream.codec_context.thread_count = threads
+
+        self.rate = Fraction(self.stream.average_rate or self.stream.guessed_rate or 0)
+        self.time_base = Fraction(self.stream.time_base)
+        self.start = self.stream.start_time or 0
+        self.fps = float(self.rate)
+        self.n_frames = self.stream.frames
+        if self.n_frames == 0 and self.stream.duration is not None: # not all containers store the number of frames
+            self.n_frames = int(round(self.stream.duration * self.time_base * self.rate))
+        self.H = self.stream.codec_context.height
+        self.W = self.stream.codec_context.width
+
+        self.luma_only = luma_only
+        self.frames = self.container.decode(self.stream)
+        self.target = None # index of the next frame after a seek (the frames before it are decoded and dropped)
+
+    @classmethod
+    def available(cls) -> bool:
+        return av is not None
+
+    def _index(self, frame) -> int:
+        return int(round((frame.pts - self.start) * self.time_base * self.rate))
+
+    def _next(self):
+        for frame in self.frames:
+            if self.target is not None and frame.pts is not None and self._index(frame) < self.target:
+                continue
+            self.target = None
+            return frame
+        return None
+
+    def seek(self, fidx: int) -> None:
+        pts = self.start + round(fidx / (self.time_base * self.rate))
+        self.container.seek(pts, stream=self.stream, backward=True, any_frame=False)
+        self.frames = self.container.decode(self.stream)
+        self.target = fidx
+
+    def grab(self) -> bool:
+        return self._next() is not None
+
+    def read_gray(self, scale: float = 1.0) -> NDArray[np.uint8] | None:
+        frame = self._next()
+        if frame is None:
+            return None
+        if self.luma_only is False:
+            return downscale_frame(cv.cvtColor(frame.to_ndarray(format="bgr24"), cv.COLOR_BGR2GRAY), scale)
+        if scale < 1:
+            return frame.reformat(
+                width=round(self.W*scale), height=round(self.H*scale), format="gray", interpolation="AREA"
+            ).to_ndarray()
+        if frame.format.name not in LUMA_FORMATS:
+            return frame.to_ndarray(format="gray")
+
+        # a view of the luma plane (rows are padded to the line size)
+        plane = frame.planes[0]
+        luma = np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)[:, 0:frame.width]
+        full_range = frame.format.name.startswith("yuvj") or frame.format.name == "gray" or frame.color_range == 2
+        return luma if full_range is True else cv.LUT(luma, LIMITED_2_FULL)
+
+    def read_bgr(self) -> NDArray[np.uint8] | None:
+        frame = self._next()
+        return None if frame is None else frame.to_ndarray(format="bgr24")
+
+    def release(self) -> None:
+        self.container.close()
@@ -1,51 +1,287 @@
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2 as cv
 import numpy as np
 import scipy.stats
 from numpy.typing import NDArray
 
+from .profiling import profile
+
 
 def calc_median_image(img_list: list[NDArray]) -> NDArray[np.uint8]:
-    
+
     img_stack = np.array(img_list)
     median_image = np.median(img_stack, axis=0).astype(np.uint8)
     return median_image
 
 def calc_mode_image(img_list: list[NDArray]) -> NDArray[np.uint8]:
-    
+
     img_stack = np.array(img_list)
     mode_image = scipy.stats.mode(img_stack, axis=0)[0].astype(np.uint8)
     return mode_image
 
-def calc_kde_image(img_list: list[NDArray]) -> NDArray[np.uint8]:
-    
+def row_tiles(h: int, w: int, bytes_per_px: int, mem_budget_mb: float, threads: int) -> list[slice]:
+    """ splits an image into tiles of full rows, so that all threads together need at most mem_budget_mb. """
+
+    rows_per_tile = int(np.clip(mem_budget_mb * 1e6 / (threads * bytes_per_px * w), 1, h))
+    return [slice(r, min(r + rows_per_tile, h)) for r in range(0, h, rows_per_tile)]
+
+def run_tiles(func: Callable[[slice], None], tiles: list[slice], threads: int) -> None:
+
+    if threads <= 1 or len(tiles) <= 1:
+        for rows in tiles:
+            func(rows)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(func, tiles))
+
+def kde_kernel_matrix(bandwidth: int, n_vals: int = 128) -> NDArray[np.uint8]:
+    """ triangle kernels for all (compressed) gray values: row i holds the kernel centered at gray value i. """
+
+    gray_vals = np.arange(n_vals, dtype=np.int16) # need singed ints here for computing the kernels
+    dist = np.abs(gray_vals[:, None] - gray_vals[None, :]) # (128, 128) pairwise distances between all gray values
+    return np.clip(bandwidth - dist, 0, None).astype(np.uint8) # Apply triangle kernel: (h - |i-j|), clipped at 0
+
+def calc_kde_tile(img_stack_compr: NDArray[np.uint8], kernel_mtx: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    """ kde for one tile of the (compressed) image stack [n, h, w]. The kernel densities are accumulated frame by frame into one [h, w, 128] density, so memory does not grow with the number of frames. """
+
+    n = img_stack_compr.shape[0]
+    acc_dtype = np.uint16 if n * int(kernel_mtx.max()) <= np.iinfo(np.uint16).max else np.uint32
+    density = np.zeros((*img_stack_compr.shape[1:], kernel_mtx.shape[1]), dtype=acc_dtype)
+    for img in img_stack_compr:
+        density += kernel_mtx[img, :] # add kernels over the stack dimension -> color density at each pixel
+
+    return (np.argmax(density, axis=-1) * 2).astype(np.uint8) # find the most "dense" color val for each pixel
+
+def calc_kde_hist_tile(hist: NDArray[np.uint16], kernel_mtx: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    """ kde for one tile of per pixel histograms [h, w, 128] of the (compressed) gray values. The density is the histogram weighted with the kernels (exact in float32 for any realistic number of frames). """
+
+    density = hist.astype(np.float32) @ kernel_mtx.astype(np.float32)
+
+    return (np.argmax(density, axis=-1) * 2).astype(np.uint8) # find the most "dense" color val for each pixel
+
+class BlendingAccumulator(ABC):
+    """ combines frames into one image while they are fed one by one (e.g. while decoding). As long as it is cheaper, the frames are just buffered and blended at the end exactly as with a list of frames. As soon as the buffered frames would take more memory than a per pixel histogram of gray values (n_bins counts per pixel), the frames are collected into the histogram instead and the blended image is computed from the histogram. If the number of frames is known in advance (n_frames), the histogram is used right from the first frame when it will be needed. The whole blending stays within mem_budget_mb: one half for the buffered frames or the histogram, the other half for the temporary arrays when finalizing (in tiles). If the frames or the histogram do not fit at the original resolution, the frames are blended at a lower resolution and the result is upscaled again. """
+
+    n_bins = 256
+
+    def __init__(
+        self, 
+        mem_budget_mb: float = 256, 
+        threads: int = 1, 
+        shape: tuple[int, int] | None = None, 
+        n_frames: int | None = None,
+    ):
+        self.mem_budget_mb = mem_budget_mb
+        self.threads = threads
+        self.frames = []
+        self.hist = None
+        self.n = 0
+        self.shape = shape # of the original frames (taken from the first frame if not given)
+        self.n_frames = n_frames # number of frames that will be fed (worst case if not given: the histogram)
+
+    @property
+    def hist_bytes_per_px(self) -> int:
+        return self.n_bins * np.dtype(np.uint16).itemsize
+
+    @property
+    def scale_factor(self) -> float:
+        # largest scale at which the buffered frames (1 byte per pixel each) or the histogram fit into half of the budget
+        H, W = self.shape
+        bytes_per_px = self.hist_bytes_per_px if self.n_frames is None else min(self.n_frames, self.hist_bytes_per_px)
+        return min(1.0, np.sqrt(self.mem_budget_mb/2 * 1e6 / (H*W*bytes_per_px)))
+
+    @property
+    def frame_scale(self) -> float:
+        """ scale at which the frames are blended. If the shape of the original frames was given, the frames can already be fed at this scale (e.g. downscaled while decoding). """
+        return self.scale_factor
+
+    def _prepare(self, img: NDArray) -> NDArray[np.uint8]:
+        # maps one frame to the values that are accumulated (in [0, n_bins)), downscaled to the blending resolution (unless it already is)
+        if self.scale_factor < 1:
+            H, W = self.shape
+            size = (round(W*self.scale_factor), round(H*self.scale_factor))
+            if (img.shape[1], img.shape[0]) != size:
+                img = cv.resize(img, size)
+        return img
+
+    def _finalize(self, image: NDArray[np.uint8]) -> NDArray[np.uint8]:
+        # upscale again if the frames were blended at a lower resolution
+        if self.scale_factor < 1:
+            H, W = self.shape
+            image = cv.resize(image, (W, H), interpolation=cv.INTER_CUBIC)
+        return image
+
+    def _run_tiles(self, func: Callable[[slice], None], h: int, w: int, bytes_per_px: int) -> None:
+        # the temporary arrays of all threads share the other half of the budget
+        run_tiles(func, row_tiles(h, w, bytes_per_px, self.mem_budget_mb/2, self.threads), self.threads)
+
+    @abstractmethod
+    def _blend_frames(self, img_list: list[NDArray[np.uint8]]) -> NDArray[np.uint8]:
+        ...
+
+    @abstractmethod
+    def _blend_hist(self, hist: NDArray[np.uint16]) -> NDArray[np.uint8]:
+        ...
+
+    def _add_hist(self, img: NDArray[np.uint8]) -> None:
+        # every pixel increments the count of its own gray value (no duplicate indices within one frame)
+        hist_flat = self.hist.reshape(-1, self.n_bins)
+        hist_flat[np.arange(hist_flat.shape[0]), img.ravel()] += 1
+
+    @profile("blending")
+    def add(self, img: NDArray) -> None:
+
+        if self.shape is None:
+            self.shape = img.shape
+        img = self._prepare(img)
+        self.n += 1
+        if self.n > np.iinfo(np.uint16).max:
+            raise ValueError(f"too many frames for blending! (maximum {np.iinfo(np.uint16).max})")
+
+        # the histogram will be needed anyways, so the frames are not buffered at all
+        if self.hist is None and self.n_frames is not None and self.n_frames * img.itemsize >= self.hist_bytes_per_px:
+            self.hist = np.zeros((*img.shape, self.n_bins), dtype=np.uint16)
+
+        if self.hist is not None:
+            self._add_hist(img)
+            return
+
+        # switch to the histogram as soon as the buffered frames take as much memory as the histogram would
+        self.frames.append(img)
+        if len(self.frames) * img.itemsize >= self.hist_bytes_per_px:
+            self.hist = np.zeros((*img.shape, self.n_bins), dtype=np.uint16)
+            for fr in self.frames:
+                self._add_hist(fr)
+            self.frames = []
+
+    @profile("blending")
+    def result(self) -> NDArray[np.uint8]:
+
+        if self.n == 0:
+            raise ValueError("no frames to blend!")
+        if self.hist is None:
+            return self._finalize(self._blend_frames(self.frames))
+        return self._finalize(self._blend_hist(self.hist))
+
+class MedianAccumulator(BlendingAccumulator):
+
+    def _blend_frames(self, img_list: list[NDArray[np.uint8]]) -> NDArray[np.uint8]:
+
+        # per pixel, a tile needs the stacked frames, the partitioned copy of np.median (~1.2 bytes per frame) and its float64 result
+        h, w = img_list[0].shape[0:2]
+        median_image = np.empty((h, w), dtype=np.uint8)
+        def _median_tile(rows: slice) -> None:
+            median_image[rows] = calc_median_image([img[rows] for img in img_list])
+
+        self._run_tiles(_median_tile, h, w, 3*len(img_list) + 8)
+
+        return median_image
+
+    def _blend_hist(self, hist: NDArray[np.uint16]) -> NDArray[np.uint8]:
+
+        # the median is the mean of the two middle order statistics (the same for an odd number of frames)
+        h, w = hist.shape[0:2]
+        k_lo, k_hi = (self.n - 1) // 2, self.n // 2
+        median_image = np.empty((h, w), dtype=np.uint8)
+        def _median_tile(rows: slice) -> None:
+            cumsum = np.cumsum(hist[rows], axis=-1, dtype=np.uint16) # (exact, there are at most 65535 frames)
+            v_lo = np.argmax(cumsum > k_lo, axis=-1)
+            v_hi = np.argmax(cumsum > k_hi, axis=-1)
+            median_image[rows] = ((v_lo + v_hi) / 2).astype(np.uint8)
+
+        self._run_tiles(_median_tile, h, w, self.n_bins * (2 + 1)) # the cumulative counts and one comparison
+
+        return median_image
+
+class ModeAccumulator(BlendingAccumulator):
+
+    def _blend_frames(self, img_list: list[NDArray[np.uint8]]) -> NDArray[np.uint8]:
+
+        # per pixel, a tile needs the stacked frames and the working arrays of scipy.stats.mode (~26 bytes per frame)
+        h, w = img_list[0].shape[0:2]
+        mode_image = np.empty((h, w), dtype=np.uint8)
+        def _mode_tile(rows: slice) -> None:
+            mode_image[rows] = calc_mode_image([img[rows] for img in img_list])
+
+        self._run_tiles(_mode_tile, h, w, 27*len(img_list))
+
+        return mode_image
+
+    def _blend_hist(self, hist: NDArray[np.uint16]) -> NDArray[np.uint8]:
+        return np.argmax(hist, axis=-1).astype(np.uint8) # the smallest of multiple modes (like scipy.stats.mode)
+
+class KDEAccumulator(BlendingAccumulator):
+    """ per pixel kde over all frames (the most "dense" gray value of each pixel). By default, frames are downscaled to ~1 MP for the kde and the result is upscaled again. With native_res=True, the kde runs at full resolution (as far as the memory budget allows). Either way, the densities are computed in tiles of full rows, and the tiles are processed by multiple threads. """
+
+    n_bins = 128 # gray values are compressed to 7 bit
     desired_n_px_for_kde = 1e6
     bandwidth = 10
-    
-    # compress image if too large
-    H, W = img_list[0].shape # store for reverting compression
-    scale_factor = np.sqrt(desired_n_px_for_kde / (H*W)) # compress by this factor to not exceed memory!
-    if scale_factor < 1:
-        img_list = [cv.resize(img, None, fx=scale_factor, fy=scale_factor) for img in img_list]
-    
-    img_stack = np.array(img_list)
-    img_stack_compr = (img_stack / 2).astype(np.uint8) # compress color channels
 
-    # prepare kde kernels
-    gray_vals = np.arange(128, dtype=np.int8) # need singed ints here for computing the kernels
-    dist = np.abs(gray_vals[:, None] - gray_vals[None, :])  # (256, 256) pairwise distances between all gray values
-    kernel_mtx = np.clip(bandwidth - dist, 0, None).astype(np.uint8) # Apply triangle kernel: (h - |i-j|), clipped at 0
+    def __init__(
+        self, 
+        native_res: bool = False, 
+        mem_budget_mb: float = 256, 
+        threads: int = 1, 
+        shape: tuple[int, int] | None = None,
+        n_frames: int | None = None,
+    ):
+        super().__init__(mem_budget_mb=mem_budget_mb, threads=threads, shape=shape, n_frames=n_frames)
+        self.native_res = native_res
+        self.kernel_mtx = kde_kernel_matrix(self.bandwidth, self.n_bins)
+
+    @property
+    def scale_factor(self) -> float:
+        if self.native_res is True:
+            return super().scale_factor
+        H, W = self.shape
+        return min(super().scale_factor, np.sqrt(self.desired_n_px_for_kde / (H*W))) # compress by this factor to not exceed memory!
+
+    def _prepare(self, img: NDArray) -> NDArray[np.uint8]:
+        # compress image if too large (unless it already is), then compress color channels
+        return (super()._prepare(img) / 2).astype(np.uint8)
+
+    def _finalize(self, kde_image: NDArray[np.uint8]) -> NDArray[np.uint8]:
+
+        # upscale again if image was too large, then slightly smoothen image
+        return cv.GaussianBlur(super()._finalize(kde_image), (11, 11), 0)
+
+    def _blend_frames(self, img_list: list[NDArray[np.uint8]]) -> NDArray[np.uint8]:
+
+        # per pixel, a tile needs the stacked frames, the density (128 x 4 bytes at most) and the queried kernels (128 x 1 byte)
+        h, w = img_list[0].shape[0:2]
+        kde_image = np.empty((h, w), dtype=np.uint8)
+        def _kde_tile(rows: slice) -> None:
+            kde_image[rows] = calc_kde_tile(np.array([img[rows] for img in img_list]), self.kernel_mtx)
+
+        self._run_tiles(_kde_tile, h, w, len(img_list) + self.n_bins * (4 + 1))
+
+        return kde_image
+
+    def _blend_hist(self, hist: NDArray[np.uint16]) -> NDArray[np.uint8]:
+
+        # per pixel, a tile needs the histogram and the density (both 128 x 4 bytes as float32)
+        h, w = hist.shape[0:2]
+        kde_image = np.empty((h, w), dtype=np.uint8)
+        def _kde_tile(rows: slice) -> None:
+            kde_image[rows] = calc_kde_hist_tile(hist[rows], self.kernel_mtx)
+
+        self._run_tiles(_kde_tile, h, w, self.n_bins * (4 + 4))
 
-    # do kde
-    queried_kernels = kernel_mtx[img_stack_compr, :] # n, H, W, 128
-    density = np.sum(queried_kernels, axis=0) # add kernels over the stack dimension -> color density at each pixel
-    kde_image = (np.argmax(density, axis=-1) * 2).astype(np.uint8) # find the most "dense" color val for each pixel
+        return kde_image
 
-    # upscale again if image was too large
-    if scale_factor < 1:
-        kde_image = cv.resize(kde_image, (W, H), interpolation=cv.INTER_CUBIC)
-        
-    # slightly smoothen image
-    kde_image = cv.GaussianBlur(kde_image, (11, 11), 0)
+def calc_kde_image(
+    img_list: list[NDArray],
+    native_res: bool = False,
+    mem_budget_mb: float = 256,
+    threads: int = 1,
+) -> NDArray[np.uint8]:
+    """ kde blending of a list of frames (see KDEAccumulator). """
 
-    return kde_image
+    accumulator = KDEAccumulator(native_res=native_res, mem_budget_mb=mem_budget_mb, threads=threads, n_frames=len(img_list))
+    for img in img_list:
+        accumulator.add(img)
 
+    return accumulator.result()
@@ -1,3 +1,6 @@
+import re
+from collections.abc import Callable
+
 import cv2 as cv
 import numpy as np
 import plotly.graph_objects as go
@@ -10,3 +13,53 @@ def fig_2_numpy(figure: go.Figure) -> NDArray:
     img = cv.imdecode(img_bytes, cv.IMREAD_UNCHANGED)
     
     return img
+
+def rgba_2_bgr(rgba: str) -> tuple[tuple[int, int, int], float]:
+    """ parses a plotly color string "rgba(r, g, b, a)" into a cv2 color (b, g, r) and the alpha value. """
+    
+    r, g, b, a = [float(vl) for vl in re.findall(r"[\d.]+", rgba)[0:4]]
+    return (int(b), int(g), int(r)), a
+
+def rgba_2_bgr_flat(rgba: str, background: str) -> tuple[int, int, int]:
+    """ opaque cv2 color of a (semi-transparent) plotly color string on top of an opaque background color. """
+    
+    (col, alpha), (bkg, _) = rgba_2_bgr(rgba), rgba_2_bgr(background)
+    return tuple(int(round(alpha*cl + (1-alpha)*bk)) for cl, bk in zip(col, bkg))
+
+def draw_rgba(img: NDArray[np.uint8], rgba: str, draw: Callable[[NDArray[np.uint8], tuple[int, int, int]], None]) -> None:
+    """ draws with a (semi-transparent) plotly color string: draw(canvas, color) paints opaque into a copy of the image, which is then alpha blended into the image (in place). everything drawn in one call shares the alpha value. """
+    
+    color, alpha = rgba_2_bgr(rgba)
+    overlay = img.copy()
+    draw(overlay, color)
+    cv.addWeighted(overlay, alpha, img, 1 - alpha, 0, dst=img)
+
+def put_text(
+    img: NDArray[np.uint8], 
+    text: str, 
+    xy: tuple[float, float], 
+    size: float, 
+    color: tuple[int, int, int],
+    anchor: tuple[str, str] = ("left", "middle"),
+    bold: bool = False,
+    vertical: bool = False,
+) -> int:
+    """ draws text with cv2 (Hershey font), size is the approximate font size in px. anchor is (x: left|center|right, y: top|middle|bottom), like plotly annotations. vertical text reads from bottom to top. returns the width of the text in px. """
+    
+    font = cv.FONT_HERSHEY_SIMPLEX
+    thickness = 2 if bold is True else 1
+    scale = cv.getFontScaleFromHeight(font, max(1, int(round(0.65*size))), thickness)
+    (tw, th), _ = cv.getTextSize(text, font, scale, thickness)
+    
+    # vertical text: draw horizontally into the rotated image (rotate coordinates accordingly), then rotate back
+    canvas = cv.rotate(img, cv.ROTATE_90_CLOCKWISE) if vertical is True else img
+    x, y = (img.shape[0] - xy[1], xy[0]) if vertical is True else xy
+    
+    x = x - {"left": 0, "center": tw/2, "right": tw}[anchor[0]]
+    y = y + {"top": th, "middle": th/2, "bottom": 0}[anchor[1]]
+    cv.putText(canvas, text, (int(round(x)), int(round(y))), font, scale, color, thickness, cv.LINE_AA)
+    
+    if vertical is True:
+        img[:] = cv.rotate(canvas, cv.ROTATE_90_COUNTERCLOCKWISE)
+    
+    return tw
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+
+class Profiler:
+    """ collects wall time, cpu time and call counts per stage into a target dict (stage -> [calls, wall [s], cpu [s]]), e.g. the profile of one video. As long as no target is set (profiling off), every profiled section only costs one attribute check. Sections can be entered from multiple threads and can be nested, so the stages do not add up to the total. The cpu time is the time of the whole process during a section (all threads, incl. the internal threads of cv2 and the decoder): cpu / wall well below 1 means that a stage is waiting (e.g. for I/O). """
+
+    def __init__(self):
+        self.target = None
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, wall: float, cpu: float) -> None:
+        with self.lock:
+            entry = self.target.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += cpu
+
+PROFILER = Profiler()
+
+class ProfiledSection:
+
+    __slots__ = ("stage", "wall", "cpu")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+
+    def __exit__(self, *exc) -> None:
+        if PROFILER.target is not None:
+            PROFILER.record(self.stage, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+
+def profiled(stage: str) -> ProfiledSection | nullcontext:
+    """ context manager that times one section of code as stage (does nothing while profiling is off). """
+
+    return nullcontext() if PROFILER.target is None else ProfiledSection(stage)
+
+def profile(stage: str) -> Callable[[Callable], Callable]:
+    """ decorator that times every call of a function as stage (calls the function directly while profiling is off). """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if PROFILER.target is None:
+                return func(*args, **kwargs)
+            with ProfiledSection(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+@contextmanager
+def collect_profile(target: dict, enabled: bool = True) -> Iterator[None]:
+    """ records all profiled sections within the block (of all threads of this process) into target. """
+
+    if enabled is False:
+        yield
+        return
+
+    previous = PROFILER.target
+    PROFILER.target = target
+    try:
+        yield
+    finally:
+        PROFILER.target = previous
+
+def profile_summary(profiles: list[dict]) -> dict[str, dict]:
+    """ sums up multiple profiles (e.g. of all videos): stage -> {calls, wall_s, cpu_s}. """
+
+    summary = {}
+    for prof in profiles:
+        for stage, (calls, wall, cpu) in prof.items():
+            entry = summary.setdefault(stage, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            entry["calls"] += calls
+            entry["wall_s"] += wall
+            entry["cpu_s"] += cpu
+    return summary
+
+def format_profile_table(summary: dict[str, dict], total_stage: str = "process_video") -> str:
+    """ summary as a table, slowest stages first. The share is relative to the wall time of total_stage. """
+
+    total = summary.get(total_stage, {}).get("wall_s", 0.0)
+    lines = [
+        f"{'stage':<20} | {'calls':>7} | {'wall [s]':>9} | {'mean [ms]':>9} | {'cpu [s]':>9} | {'cpu/wall':>8} | {'share':>6}",
+        "-" * 86,
+    ]
+    for stage, entry in sorted(summary.items(), key=lambda it: it[1]["wall_s"], reverse=True):
+        wall, cpu, calls = entry["wall_s"], entry["cpu_s"], entry["calls"]
+        share = f"{wall / total:6.1%}" if total > 0 else f"{'-':>6}"
+        lines.append(
+            f"{stage:<20} | {calls:7d} | {wall:9.2f} | {1e3 * wall / max(calls, 1):9.2f} | {cpu:9.2f} | "
+            f"{cpu / wall if wall > 0 else 0.0:8.2f} | {share}"
+        )
+    return "\n".join(lines)
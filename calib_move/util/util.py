@@ -5,6 +5,8 @@ import numpy as np
 from numpy.typing import NDArray
 from tqdm import tqdm
 
+from .profiling import profile
+
 
 def sec_2_tstr(seconds: float) -> str:
     
@@ -55,6 +57,7 @@ def json_2_dict(file_path: str) -> None:
         data = json.load(file)
     return data
 
+@profile("main_mode_kde")
 def main_mode_kde(
     datapoints: NDArray,
     bandwidth: float,
@@ -122,4 +125,83 @@ def main_mode_kde(
     x_argmax   = x[idx_argmax]
     agreement  = (pdf[idx_argmax] - 1) / (datapoints.shape[0] - 1)
     
-    return x_argmax, agreement
\ No newline at end of file
+    return x_argmax, agreement
+
+@profile("main_mode_kde")
+def main_mode_kde_batched(
+    datapoints: NDArray,
+    bandwidth: float,
+    n_grid: int=32,
+    max_tol: float=1e-3,
+    max_itr: int=1000
+) -> tuple[NDArray, NDArray]:
+    """ batched version of main_mode_kde (with init_method="grid-<n_grid>") for many independent distributions at once. datapoints has the shape [n_steps, n_samples], missing samples are marked as NaN. The mean shift of all steps and all starting points is fully vectorized [dim0 = steps, dim1 = starting points, dim2 = data]. Instead of removing duplicate starting points, all starting points are iterated until they converged (the result is the same up to the tolerance).
+    
+    returns the main modes and agreements of all steps (both NaN for steps without any valid datapoint). """
+    
+    data  = np.array(datapoints, dtype=np.float64, ndmin=2)
+    valid = np.isfinite(data)
+    n_valid = np.sum(valid, axis=1)
+    has_data = n_valid > 0
+    data  = np.where(valid, data, 0.0) # masked out by the weights below
+    
+    # regularly spaced starting points between min and max of each step
+    lo = np.min(np.where(valid, data, np.inf), axis=1, initial=np.inf, where=has_data[:, None])
+    hi = np.max(np.where(valid, data, -np.inf), axis=1, initial=-np.inf, where=has_data[:, None])
+    lo = np.where(has_data, lo, 0.0)
+    hi = np.where(has_data, hi, 0.0)
+    x = lo[:, None] + (hi - lo)[:, None] * np.linspace(0, 1, n_grid)[None, :]
+    
+    # iteratively update the points. only steps with at least one not yet converged point are calculated
+    active = has_data[:, None] & np.ones(x.shape, dtype=bool)
+    for _ in range(max_itr):
+        rows = np.flatnonzero(np.any(active, axis=1))
+        if len(rows) == 0:
+            break
+        x_r, data_r, valid_r = x[rows], data[rows], valid[rows]
+        
+        # weights in log space (numerically stable), shifted so that the largest one is 0 (see main_mode_kde)
+        log_weights = -0.5 * ((x_r[:, :, None] - data_r[:, None, :]) / bandwidth)**2
+        log_weights = np.where(valid_r[:, None, :], log_weights, -np.inf)
+        weights = np.exp(log_weights - np.max(log_weights, axis=2, keepdims=True))
+        
+        x_new = np.sum(weights * data_r[:, None, :], axis=2) / np.sum(weights, axis=2)
+        x_new = np.where(active[rows], x_new, x_r) # converged points stay where they are
+        
+        active[rows] = np.abs(x_new - x_r) > max_tol
+        x[rows] = x_new
+    
+    # evaluate the pdf at all converged points and pick the argmax per step. the agreement is normalized by the lowest possible peak and the amount of datapoints (see main_mode_kde)
+    pdf = np.sum(np.where(valid[:, None, :], np.exp(-0.5 * ((x[:, :, None] - data[:, None, :]) / bandwidth)**2), 0.0), axis=2)
+    idx_argmax = np.argmax(pdf, axis=1)
+    
+    steps = np.arange(data.shape[0])
+    x_argmax = np.where(has_data, x[steps, idx_argmax], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        agreement = np.where(has_data, (pdf[steps, idx_argmax] - 1) / (n_valid - 1), np.nan)
+    
+    return x_argmax, agreement
+
+class GrowableArray:
+    """ numpy array that grows row-wise (preallocated buffer, doubled whenever it is full). Appending chunks of rows costs amortized O(1) per row and no per-row python objects. """
+    
+    def __init__(self, n_cols: int, dtype: type = np.float32, capacity: int = 1024):
+        self.buffer = np.empty((capacity, n_cols), dtype=dtype)
+        self.n = 0
+    
+    def __len__(self) -> int:
+        return self.n
+    
+    def append(self, rows: NDArray) -> None:
+        
+        rows = np.asarray(rows, dtype=self.buffer.dtype).reshape(-1, self.buffer.shape[1])
+        if self.n + len(rows) > len(self.buffer):
+            buffer = np.empty((max(2*len(self.buffer), self.n + len(rows)), self.buffer.shape[1]), dtype=self.buffer.dtype)
+            buffer[0:self.n] = self.buffer[0:self.n]
+            self.buffer = buffer
+        self.buffer[self.n:self.n + len(rows)] = rows
+        self.n += len(rows)
+    
+    def array(self) -> NDArray:
+        # trimmed copy (does not keep the unused capacity alive)
+        return self.buffer[0:self.n].copy()
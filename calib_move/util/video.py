@@ -1,17 +1,135 @@
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
 import cv2 as cv
+import numpy as np
 from numpy.typing import NDArray
 
+from .framesource import FrameSource, OpenCVFrameSource, downscale_frame  # noqa: F401 (re-exported)
+from .profiling import profiled
+
 
-def get_video_frame_gry(cap: cv.VideoCapture, fidx: int) -> NDArray:
-    cap.set(cv.CAP_PROP_POS_FRAMES, fidx)
-    ret, frame = cap.read()
-    if ret is False:
+def get_video_frame_gry(source: FrameSource, fidx: int, scale: float = 1.0) -> NDArray:
+    # gray, downscaled by scale (see FrameSource.read_gray)
+    source.seek(fidx)
+    frame = source.read_gray(scale)
+    if frame is None:
         raise ValueError("could not read frame from video!")
-    return cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    return frame
 
-def get_video_frame_bgr(cap: cv.VideoCapture, fidx: int) -> NDArray:
-    cap.set(cv.CAP_PROP_POS_FRAMES, fidx)
-    ret, frame = cap.read()
-    if ret is False:
+def get_video_frame_bgr(source: FrameSource, fidx: int) -> NDArray:
+    source.seek(fidx)
+    frame = source.read_bgr()
+    if frame is None:
         raise ValueError("could not read frame from video!")
-    return frame
\ No newline at end of file
+    return frame
+
+def build_keyframe_index(path: Path) -> NDArray[np.int64]:
+    """ finds the frame indices of all keyframes (I-frames) in a video. The capture is opened in raw mode, so grab() only demuxes the packets without decoding anything, which makes this a very cheap pre-pass. Returns an empty array if the backend does not support raw mode. """
+    
+    cap = cv.VideoCapture(str(path), cv.CAP_FFMPEG, [cv.CAP_PROP_FORMAT, -1])
+    keyframes = []
+    fi = 0
+    while cap.isOpened() and cap.grab():
+        if cap.get(cv.CAP_PROP_LRF_HAS_KEY_FRAME) != 0:
+            keyframes.append(fi)
+        fi += 1
+    cap.release()
+    
+    return np.array(keyframes, dtype=np.int64)
+
+def load_keyframe_index(path: Path) -> NDArray[np.int64]:
+    """ loads the keyframe index of a video from its cache file next to the video (.<video-name>.keyframes.npy) or builds and caches it if it does not exist yet or is older than the video. If the video folder is not writable, the index is just not cached. """
+    
+    path = Path(path)
+    cache_path = path.with_name(f".{path.name}.keyframes.npy")
+    if cache_path.is_file() and cache_path.stat().st_mtime >= path.stat().st_mtime:
+        return np.load(cache_path)
+    
+    keyframes = build_keyframe_index(path)
+    try:
+        np.save(cache_path, keyframes)
+    except OSError:
+        pass # caching is only an optimization
+    
+    return keyframes
+
+def snap_to_keyframes(fidx: NDArray, keyframes: NDArray, tolerance: float) -> NDArray[np.int64]:
+    """ moves every frame index to its nearest keyframe, if there is one within the tolerance (in frames). Reading a keyframe only costs the decoding of a single frame. fidx is expected to have one row of sub-frame indices per main step. Within a row, an index that would land on an already taken keyframe keeps its original position (identical sub-frames would fake a perfect agreement). """
+    
+    fidx = np.asarray(fidx, dtype=np.int64)
+    if len(keyframes) == 0:
+        return fidx
+    
+    # nearest keyframe (left or right neighbour) for each index
+    right = np.clip(np.searchsorted(keyframes, fidx), 0, len(keyframes)-1)
+    left = np.clip(right-1, 0, len(keyframes)-1)
+    nearest = np.where(np.abs(keyframes[left] - fidx) <= np.abs(keyframes[right] - fidx), keyframes[left], keyframes[right])
+    snapped = np.where(np.abs(nearest - fidx) <= tolerance, nearest, fidx)
+    
+    # revert duplicates within one main step
+    for row_snapped, row_orig in zip(np.atleast_2d(snapped), np.atleast_2d(fidx)):
+        _, first = np.unique(row_snapped, return_index=True)
+        dup = np.ones(row_snapped.shape, dtype=bool)
+        dup[first] = False
+        row_snapped[dup] = row_orig[dup]
+    
+    return snapped
+
+class FramePlan:
+    """ serves a set of frame indices (sorted and deduplicated) from one forward pass through a video. Small gaps between requested frames are skipped with grab() (decode only, no color conversion), only requested frames are retrieve()-d. Since every seek has to decode from the previous keyframe anyways, a real seek is only done when the gap is larger than the estimated cost of a seek (in frames). If the keyframe index of the video is known, the exact cost is used instead of the estimate. skip is asked right before each frame is decoded: frames that are no longer needed (e.g. early exit) are left out without decoding them. open_source opens the video with a decoding backend (see FrameSource). The frames are gray and downscaled by scale (see FrameSource.read_gray). """
+
+    def __init__(
+        self, 
+        path: Path, 
+        indices: NDArray, 
+        seek_cost: int, 
+        keyframes: NDArray | None = None, 
+        skip: Callable[[int], bool] | None = None,
+        open_source: Callable[[Path], FrameSource] = OpenCVFrameSource,
+        scale: float = 1.0,
+    ):
+        self.path = path
+        self.indices = np.unique(np.asarray(indices, dtype=np.int64)) # sorted and deduplicated
+        self.seek_cost = seek_cost
+        self.keyframes = keyframes if (keyframes is not None and len(keyframes) > 0) else None
+        self.skip = skip
+        self.open_source = open_source
+        self.scale = scale
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def _needs_seek(self, pos: int, fidx: int) -> bool:
+        if fidx < pos:
+            return True
+        # cost model: skipping forward costs one grab per frame, a seek costs roughly <seek_cost> grabs
+        if self.keyframes is None:
+            return fidx - pos > self.seek_cost
+        # exact: a seek decodes from the keyframe before fidx, so it only pays off if that keyframe lies ahead of pos
+        prev_kf = self.keyframes[max(np.searchsorted(self.keyframes, fidx, side="right") - 1, 0)]
+        return prev_kf > pos
+
+    def __iter__(self) -> Iterator[tuple[int, NDArray[np.uint8]]]:
+        source = self.open_source(self.path)
+        pos = 0 # index of the frame that the next grab() returns
+        try:
+            for fi in self.indices:
+                if self.skip is not None and self.skip(int(fi)) is True:
+                    continue
+                if self._needs_seek(pos, fi):
+                    with profiled("seek"):
+                        source.seek(fi)
+                    pos = fi
+                with profiled("decode"): # the consumer of the frames is not included
+                    while pos < fi:
+                        if source.grab() is False:
+                            raise ValueError("could not grab frame from video!")
+                        pos += 1
+                    frame_gry = source.read_gray(self.scale)
+                    pos += 1
+                    if frame_gry is None:
+                        raise ValueError("could not read frame from video!")
+                yield int(fi), frame_gry
+        finally:
+            source.release()
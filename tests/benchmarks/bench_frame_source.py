@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import tyro
+
+# for testing, insert package into path to make sure that the local folder is used!
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[2]))
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parent))
+from bench_process_video import SCENARIOS
+from synthetic import ensure_video
+
+from calib_move.config.coreconfig import SEEK_COST_FRAMES, DecodeBackend
+from calib_move.util.video import FramePlan
+
+# a frame counts as different (wrong frame index) when its mean absolute gray value difference to the reference backend is larger than this. the gray conversions of the backends (and the luma plane with luma_only) differ by a few gray values.
+MAX_FRAME_DIFF = 8.0
+
+
+def sequential(backend: DecodeBackend, path: Path, threads: int, luma: bool, max_frames: int, scale: float = 1.0) -> float:
+    """ frames/s when decoding the first max_frames frames one after the other (gray, downscaled by scale). """
+
+    with backend.open(path, threads=threads, luma_only=luma) as source:
+        t0 = time.perf_counter()
+        n = 0
+        while n < max_frames and source.read_gray(scale) is not None:
+            n += 1
+        return n / (time.perf_counter() - t0)
+
+def random_access(backend: DecodeBackend, path: Path, threads: int, luma: bool, indices: np.ndarray) -> tuple[float, list[np.ndarray]]:
+    """ ms per frame when seeking to each of the indices (in random order), and the frames. """
+
+    frames = [None] * len(indices)
+    with backend.open(path, threads=threads, luma_only=luma) as source:
+        t0 = time.perf_counter()
+        for i in np.random.default_rng(0).permutation(len(indices)):
+            source.seek(int(indices[i]))
+            frames[i] = source.read_gray()
+        return 1e3 * (time.perf_counter() - t0) / len(indices), frames
+
+def planned(backend: DecodeBackend, path: Path, threads: int, luma: bool, indices: np.ndarray) -> float:
+    """ frames/s when reading the indices in one forward pass (FramePlan, as in the processing). """
+
+    plan = FramePlan(
+        path, indices, seek_cost=SEEK_COST_FRAMES, open_source=lambda pt: backend.open(pt, threads=threads, luma_only=luma)
+    )
+    t0 = time.perf_counter()
+    n = sum(1 for _ in plan)
+    return n / (time.perf_counter() - t0)
+
+def run_backend_benchmarks(
+    videos: tuple[Path, ...] = (),
+    scenarios: tuple[str, ...] = ("shift_720p", "zoom_1080p", "shift_2160p"),
+    backends: tuple[DecodeBackend, ...] = tuple(DecodeBackend),
+    threads: tuple[int, ...] = (1, 0),
+    luma_only: tuple[bool, ...] = (False, True),
+    n_random: int = 40,
+    max_frames: int = 500,
+    scale: float = 0.5,
+    video_dir: Path = Path(__file__).resolve().parent/".videos",
+) -> None:
+    """ compares the decoding backends on the same files, with the default gray conversion (BGR and back to gray) and with the luma plane (luma_only): sequential decoding (native and downscaled), random access (seek + read) and the sparse forward pass of the processing (FramePlan). The frames read at the random indices are compared against the first backend, so that a backend that is off by a frame is noticed.
+
+    Args:
+        videos: video files to benchmark (in addition to the scenarios).
+        scenarios: names of synthetic scenarios (see bench_process_video.py) to benchmark.
+        backends: decoding backends to compare (unavailable ones are skipped).
+        threads: decoding thread counts to run every backend with (0 = automatic).
+        luma_only: gray paths to run every backend with (False = conversion to BGR and back to gray, True = luma plane).
+        n_random: number of random frame indices for the random access.
+        max_frames: maximum number of frames for the sequential decoding.
+        scale: scale of the downscaled sequential decoding.
+        video_dir: where the synthetic videos are rendered to (only once, they are reused afterwards).
+    """
+
+    backends = [bk for bk in backends if bk.available() is True]
+    if len(backends) == 0:
+        raise ValueError("no decoding backend available!")
+
+    print("rendering synthetic videos (only once)...")
+    paths = [ensure_video(sc, video_dir) for sc in SCENARIOS if sc.name in scenarios] + list(videos)
+
+    print(f"\n{'video':<28} | {'backend':<7} | {'threads':>7} | {'luma':>5} | {'seq [f/s]':>9} | {'scaled [f/s]':>12} | {'seek [ms]':>9} | {'plan [f/s]':>10} | {'max diff':>8}")
+    for path in paths:
+        with backends[0].open(path) as source:
+            n_frames, fps = source.n_frames, source.fps
+        rng = np.random.default_rng(0)
+        indices_random = np.sort(rng.choice(n_frames - 1, size=min(n_random, n_frames - 1), replace=False))
+        indices_plan = np.unique(np.linspace(0, n_frames - 2, 80).astype(np.int64)) # roughly the sub-frames of 16 main steps
+
+        reference = None
+        for backend in backends:
+            with backend.open(path) as source:
+                if (source.n_frames, round(source.fps, 3)) != (n_frames, round(fps, 3)):
+                    print(f"WARNING: {backend.name} reads different metadata! ({source.n_frames} frames @ {source.fps:.3f} fps)")
+            for th, luma in ((th, luma) for th in threads for luma in luma_only):
+                fps_seq = sequential(backend, path, th, luma, max_frames)
+                fps_scaled = sequential(backend, path, th, luma, max_frames, scale)
+                ms_seek, frames = random_access(backend, path, th, luma, indices_random)
+                fps_plan = planned(backend, path, th, luma, indices_plan)
+
+                reference = frames if reference is None else reference
+                diff = max(
+                    np.inf if fr is None else float(np.mean(np.abs(fr.astype(np.float32) - rf.astype(np.float32))))
+                    for fr, rf in zip(frames, reference)
+                )
+                print(
+                    f"{path.name[0:28]:<28} | {backend.name:<7} | {th:>7} | {str(luma):>5} | {fps_seq:9.1f} | {fps_scaled:12.1f} | {ms_seek:9.2f} | {fps_plan:10.1f} | "
+                    f"{diff:8.2f}{'  FRAME MISMATCH' if diff > MAX_FRAME_DIFF else ''}"
+                )
+
+if __name__ == "__main__":
+    tyro.cli(run_backend_benchmarks)
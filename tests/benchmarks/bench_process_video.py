@@ -0,0 +1,232 @@
+import json
+import os
+import platform
+import shlex
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+import tyro
+
+try:
+    import resource  # peak memory of the process (not available on windows)
+except ImportError:
+    resource = None
+
+# for testing, insert package into path to make sure that the local folder is used!
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[2]))
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parent))
+from synthetic import CameraEvent, Scenario, ensure_video
+
+from calib_move.config.coreconfig import HO_GRID_RES, T_SUBFR
+from calib_move.core.containers import CLIArgs, VideoContainer
+from calib_move.core.processing import (
+    calculate_movements,
+    detect_static_features,
+    evaluate_homographies,
+    frame_indices,
+    generate_static_frame,
+    process_video,
+)
+
+# synthetic test videos (ground truth camera motion, distractors, different resolutions and lengths) ------------------
+SCENARIOS = [
+    Scenario("static_480p", H=480, W=854, duration=40, n_distractors=6),
+    Scenario("shift_720p", H=720, W=1280, duration=60, events=(CameraEvent(30, "shift", (6, -4)),)),
+    Scenario("rotate_720p", H=720, W=1280, duration=60, events=(CameraEvent(25, "rotate", 0.8),)),
+    Scenario("zoom_1080p", H=1080, W=1920, duration=60, events=(CameraEvent(35, "zoom", 1.015),)),
+    Scenario("mixed_long_720p", H=720, W=1280, duration=240, fps=15, n_distractors=8, events=(
+        CameraEvent(60, "shift", (10, 0)),
+        CameraEvent(120, "rotate", -0.5),
+        CameraEvent(180, "zoom", 0.98),
+        CameraEvent(210, "shift", (-10, 3)),
+    )),
+    Scenario("shift_2160p", H=2160, W=3840, duration=30, fps=10, events=(CameraEvent(20, "shift", (12, 0)),)),
+]
+
+# a scenario counts as regressed when it is slower / uses more memory by these factors or is less accurate by ERR_TOL_PX
+TIME_TOL = 0.25
+MEM_TOL = 0.25
+ERR_TOL_PX = 0.5
+
+
+def peak_rss_mb() -> float | None:
+    # linux: the peak of this process image (ru_maxrss would include the peak of the parent before the exec)
+    status = Path("/proc/self/status")
+    if status.is_file():
+        return next(int(ln.split()[1]) / 1e3 for ln in status.read_text().splitlines() if ln.startswith("VmHWM:"))
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3 # bytes on macos, kilobytes elsewhere
+
+def ground_truth(scenario: Scenario, timestamps: list[float]) -> tuple[np.ndarray, np.ndarray]:
+    """ true movement (same metric as the estimate) at each main step, and whether the camera pose is constant over the sub-frames of the step (only those steps can be compared). """
+
+    poses = np.array([scenario.pose(t) for t in timestamps])
+    movements = evaluate_homographies(poses, (scenario.H, scenario.W), HO_GRID_RES)[0]
+    constant = np.array([
+        np.allclose(scenario.pose(t - T_SUBFR), scenario.pose(t + T_SUBFR)) for t in timestamps
+    ])
+    return movements, constant
+
+def make_container(scenario: Scenario, path: Path) -> VideoContainer:
+
+    cap = cv.VideoCapture(path)
+    video = VideoContainer(
+        path=path,
+        fpsc=cap.get(cv.CAP_PROP_FPS),
+        ftot=int(cap.get(cv.CAP_PROP_FRAME_COUNT)),
+        H=int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)),
+        W=int(cap.get(cv.CAP_PROP_FRAME_WIDTH)),
+        static_window=scenario.static_window,
+    )
+    cap.release()
+    return video
+
+def run_scenario(CLIARGS: CLIArgs, scenario: Scenario, path: Path) -> dict:
+    """ runs in a fresh process (so that the peak memory belongs to this scenario only): process_video end to end, then every stage on its own. """
+
+    rss_start = peak_rss_mb()
+
+    # end to end -------------------------------------------------------------------------------------------------------
+    video = make_container(scenario, path)
+    t0 = time.perf_counter()
+    process_video(CLIARGS, video)
+    t_total = time.perf_counter() - t0
+    rss_peak = peak_rss_mb()
+
+    # accuracy against ground truth (steps with a camera movement within their sub-frames are skipped) -----------------
+    gt, constant = ground_truth(scenario, video.timestamps)
+    errors = np.array(video.errors, dtype=bool)
+    dev = np.abs(np.array(video.movements, dtype=np.float64) - gt)[constant & ~errors]
+
+    # stages -----------------------------------------------------------------------------------------------------------
+    stages = {}
+    video_st = make_container(scenario, path)
+    t0 = time.perf_counter()
+    fidx_init, fidx_sub = frame_indices(CLIARGS, video_st)
+    stages["frame_indices"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    static_frame = generate_static_frame(CLIARGS, video_st, fidx_init)
+    stages["blending"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    kps_0, dsc_0 = detect_static_features(CLIARGS, video_st, static_frame)
+    stages["static_features"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    calculate_movements(CLIARGS, video_st, static_frame, kps_0, dsc_0, fidx_sub)
+    stages["movements"] = time.perf_counter() - t0
+
+    return {
+        "resolution": [scenario.W, scenario.H],
+        "n_frames": video.ftot,
+        "duration_s": video.stot,
+        "time_s": t_total,
+        "frames_per_s": video.ftot / t_total,
+        "videos_per_min": 60 / t_total,
+        "peak_rss_mb": rss_peak,
+        "rss_increase_mb": None if rss_peak is None else rss_peak - rss_start,
+        "stages_s": stages,
+        "n_steps": len(video.movements),
+        "n_subframes": int(np.sum(video.subframes)), # evaluated sub-frames (less than n_steps * N_SUBFR with early exit)
+        "n_compared": int(np.sum(constant & ~errors)),
+        "n_failed": int(np.sum(constant & errors)), # steps that should have an estimate, but failed
+        "mean_err_px": float(np.mean(dev)) if len(dev) > 0 else None,
+        "max_err_px": float(np.max(dev)) if len(dev) > 0 else None,
+    }
+
+def machine_info() -> dict:
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv.__version__,
+    }
+
+def regressions(current: dict, base: dict) -> list[str]:
+
+    found = []
+    if current["time_s"] > (1 + TIME_TOL) * base["time_s"]:
+        found.append(f"time {base['time_s']:.2f} -> {current['time_s']:.2f} s")
+    if None not in (current["peak_rss_mb"], base["peak_rss_mb"]) and current["peak_rss_mb"] > (1 + MEM_TOL) * base["peak_rss_mb"]:
+        found.append(f"memory {base['peak_rss_mb']:.0f} -> {current['peak_rss_mb']:.0f} MB")
+    if None not in (current["mean_err_px"], base["mean_err_px"]) and current["mean_err_px"] > base["mean_err_px"] + ERR_TOL_PX:
+        found.append(f"error {base['mean_err_px']:.2f} -> {current['mean_err_px']:.2f} px")
+    if current["n_failed"] > base["n_failed"]:
+        found.append(f"failed steps {base['n_failed']} -> {current['n_failed']}")
+    return found
+
+def run_benchmarks(
+    scenarios: tuple[str, ...] = (),
+    cli: str = "",
+    video_dir: Path = Path(__file__).resolve().parent/".videos",
+    baseline: Path = Path(__file__).resolve().parent/"baseline.json",
+    update_baseline: bool = False,
+) -> None:
+    """ benchmarks process_video on synthetic videos with known camera motion: throughput, peak memory, time per stage and movement error against ground truth. The results are compared to a stored baseline (json) to make performance regressions visible.
+
+    Args:
+        scenarios: names of the scenarios to run (all if empty).
+        cli: additional processing options as for calib-move-run (e.g. --cli="--proc-scale 0.5 --threads 4").
+        video_dir: where the synthetic videos are rendered to (only once, they are reused afterwards).
+        baseline: json file with the baseline results.
+        update_baseline: store the results as the new baseline (instead of comparing against it).
+    """
+
+    selected = [sc for sc in SCENARIOS if len(scenarios) == 0 or sc.name in scenarios]
+    if len(selected) == 0:
+        raise ValueError(f"no such scenario! (got {scenarios}, available: {[sc.name for sc in SCENARIOS]})")
+
+    CLIARGS = tyro.cli(CLIArgs, args=[
+        "--input-path", "not-important", "--output-path", "not-important", "--static-window", "not-important",
+        *shlex.split(cli),
+    ])
+
+    print("rendering synthetic videos (only once)...")
+    paths = {sc.name: ensure_video(sc, video_dir) for sc in selected}
+
+    results = {}
+    for sc in selected:
+        print(f"running {sc.name}...")
+        # fresh process per scenario: no caches or memory peaks are carried over from the previous one
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            results[sc.name] = pool.submit(run_scenario, CLIARGS, sc, paths[sc.name]).result()
+
+    # report -----------------------------------------------------------------------------------------------------------
+    base = json.loads(baseline.read_text()) if baseline.is_file() else None
+    if base is not None and base["cli"] != cli:
+        print(f"WARNING: the baseline was recorded with other processing options! (\"{base['cli']}\")")
+
+    def fmt(vl: float | None, spec: str) -> str:
+        return "-" if vl is None else format(vl, spec)
+
+    print(f"\n{'scenario':<16} | {'time [s]':>8} | {'frames/s':>8} | {'vids/min':>8} | {'peak [MB]':>9} | {'err [px]':>8} | {'max [px]':>8} | {'failed':>6}")
+    regressed = {}
+    for name, res in results.items():
+        print(
+            f"{name:<16} | {res['time_s']:8.2f} | {res['frames_per_s']:8.1f} | {res['videos_per_min']:8.2f} | "
+            f"{fmt(res['peak_rss_mb'], '9.0f'):>9} | {fmt(res['mean_err_px'], '8.3f'):>8} | {fmt(res['max_err_px'], '8.3f'):>8} | {res['n_failed']:6d}"
+        )
+        print(" " * 16 + " | stages: " + ", ".join(f"{st} {tm:.2f} s" for st, tm in res["stages_s"].items()))
+        if base is not None and name in base["scenarios"]:
+            regressed[name] = regressions(res, base["scenarios"][name])
+
+    for name, found in regressed.items():
+        if len(found) > 0:
+            print(f"REGRESSION in {name}: {', '.join(found)}")
+    if base is not None and not any(len(fd) > 0 for fd in regressed.values()):
+        print("no regressions against the baseline")
+
+    if update_baseline is True or base is None:
+        # only the selected scenarios are replaced, the others are kept
+        scenarios_all = {**(base["scenarios"] if base is not None else {}), **results}
+        baseline.write_text(json.dumps({"machine": machine_info(), "cli": cli, "scenarios": scenarios_all}, indent=4))
+        print(f"stored baseline: {baseline}")
+
+if __name__ == "__main__":
+    tyro.cli(run_benchmarks)
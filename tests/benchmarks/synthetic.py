@@ -0,0 +1,137 @@
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+
+# part of the video file names: bump when the rendering changes, so that stale videos are not reused
+RENDER_VERSION = 1
+
+
+@dataclass(frozen=True)
+class CameraEvent:
+    """ a sudden camera movement at time t [s]. kind is "shift" (value = (dx, dy) [px]), "rotate" (value = angle [deg], around the image center) or "zoom" (value = scale factor, around the image center). Events accumulate: the camera stays in its new pose afterwards. """
+
+    t: float
+    kind: str
+    value: float | tuple[float, float]
+
+    def matrix(self, H: int, W: int) -> NDArray[np.float64]:
+        # homography that maps reference pixels to pixels of the moved camera
+        cx, cy = (W - 1) / 2, (H - 1) / 2
+        if self.kind == "shift":
+            M = np.array([[1, 0, self.value[0]], [0, 1, self.value[1]]], dtype=np.float64)
+        elif self.kind == "rotate":
+            M = cv.getRotationMatrix2D((cx, cy), self.value, 1.0)
+        elif self.kind == "zoom":
+            M = cv.getRotationMatrix2D((cx, cy), 0.0, self.value)
+        else:
+            raise ValueError(f"unknown camera event kind! (got {self.kind})")
+        return np.concatenate([M, [[0, 0, 1]]], axis=0)
+
+@dataclass(frozen=True)
+class Scenario:
+    """ a synthetic video: a random static scene seen by a camera that moves at the given events, with moving distractor objects (people, instruments, ...) in front of it. """
+
+    name: str
+    H: int
+    W: int
+    duration: float # [s]
+    fps: float = 25.0
+    events: tuple[CameraEvent, ...] = ()
+    n_distractors: int = 4
+    static_window: tuple[float, float] = (0.0, 8.0) # [s], before the first event
+    noise: float = 2.0 # std of the per-frame sensor noise [gray values]
+    seed: int = 0
+
+    @property
+    def n_frames(self) -> int:
+        return int(round(self.duration * self.fps))
+
+    def pose(self, t: float) -> NDArray[np.float64]:
+        """ ground truth homography (reference -> frame) of the camera at time t. """
+
+        HO = np.eye(3)
+        for ev in sorted(self.events, key=lambda ev: ev.t):
+            if ev.t <= t:
+                HO = ev.matrix(self.H, self.W) @ HO
+        return HO
+
+def render_scene(H: int, W: int, rng: np.random.Generator) -> NDArray[np.uint8]:
+    """ static textured scene (low-pass noise with random shapes, so that there are plenty of keypoints). """
+
+    scene = rng.normal(128, 40, (H // 24 + 1, W // 24 + 1)).astype(np.float32)
+    scene = cv.resize(scene, (W, H), interpolation=cv.INTER_CUBIC)
+    scene += rng.normal(0, 4, (H, W)).astype(np.float32)
+
+    side = max(H, W)
+    for _ in range(int(80 * H * W / 1e6) + 40):
+        color = float(rng.uniform(0, 255))
+        center = (int(rng.uniform(0, W)), int(rng.uniform(0, H)))
+        size = int(rng.uniform(0.005, 0.04) * side)
+        if rng.uniform() < 0.5:
+            cv.circle(scene, center, size, color, -1, cv.LINE_AA)
+        else:
+            cv.rectangle(scene, center, (center[0] + size, center[1] + int(size * rng.uniform(0.5, 2))), color, -1)
+
+    return np.clip(scene, 0, 255).astype(np.uint8)
+
+class SyntheticVideo:
+    """ renders the frames of a scenario (the scene warped by the camera pose, plus distractors and noise). """
+
+    def __init__(self, scenario: Scenario):
+        self.sc = scenario
+        rng = np.random.default_rng(scenario.seed)
+        self.scene = render_scene(scenario.H, scenario.W, rng)
+        self.noise_rng = np.random.default_rng(scenario.seed + 1)
+
+        # distractors: blobs moving on straight lines (bouncing off the image borders)
+        side = max(scenario.H, scenario.W)
+        self.d_pos = rng.uniform(0, 1, (scenario.n_distractors, 2)) * [scenario.W, scenario.H]
+        self.d_vel = rng.uniform(-0.15, 0.15, (scenario.n_distractors, 2)) * side # [px/s]
+        self.d_size = rng.uniform(0.04, 0.10, scenario.n_distractors) * side
+        self.d_color = rng.uniform(0, 255, scenario.n_distractors)
+
+    def frame(self, fi: int) -> NDArray[np.uint8]:
+
+        sc = self.sc
+        t = fi / sc.fps
+        frame = cv.warpPerspective(self.scene, sc.pose(t), (sc.W, sc.H), borderMode=cv.BORDER_REFLECT)
+
+        # positions at time t (reflected at the borders)
+        pos = np.abs(np.mod(self.d_pos + self.d_vel * t, 2 * np.array([sc.W, sc.H])))
+        pos = np.where(pos > [sc.W, sc.H], 2 * np.array([sc.W, sc.H]) - pos, pos)
+        for (x, y), size, color in zip(pos, self.d_size, self.d_color):
+            cv.ellipse(frame, (int(x), int(y)), (int(size), int(size * 0.6)), 0, 0, 360, float(color), -1, cv.LINE_AA)
+
+        if sc.noise > 0:
+            frame = np.clip(frame + self.noise_rng.normal(0, sc.noise, frame.shape), 0, 255).astype(np.uint8)
+        return frame
+
+    def write(self, path: Path) -> Path:
+        """ encodes the video (mp4v, BGR) to path. """
+
+        sc = self.sc
+        writer = cv.VideoWriter(str(path), cv.VideoWriter_fourcc(*"mp4v"), sc.fps, (sc.W, sc.H))
+        if writer.isOpened() is False:
+            raise ValueError(f"could not open video writer! (got {path})")
+        try:
+            for fi in range(sc.n_frames):
+                writer.write(cv.cvtColor(self.frame(fi), cv.COLOR_GRAY2BGR))
+        finally:
+            writer.release()
+        return path
+
+def ensure_video(scenario: Scenario, video_dir: Path) -> Path:
+    """ path to the encoded video of a scenario (only rendered if it does not exist yet). the file name holds a hash of the scenario, so changed scenarios are rendered again. """
+
+    video_dir.mkdir(parents=True, exist_ok=True)
+    key = hashlib.sha1(f"{RENDER_VERSION}{scenario!r}".encode()).hexdigest()[0:10]
+    path = video_dir / f"{scenario.name}_{key}.mp4"
+    if path.is_file() is False:
+        path_tmp = path.with_name(f".tmp_{path.name}")
+        SyntheticVideo(scenario).write(path_tmp)
+        path_tmp.replace(path)
+    return path
@@ -0,0 +1,22 @@
+import os
+import sys
+from pathlib import Path
+
+# for testing, insert package into path to make sure that the local folder is used!
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[1]))
+from calib_move.core.streaming import main_stream
+
+if __name__ == "__main__":
+    os.system("cls" if os.name == "nt" else "clear")
+    
+    argv = [
+        # camera index, stream url or a video file (replayed in realtime as a stand-in for a live camera)
+        "--source", "H:/code_elias/random_scrips_balgrist/test_videos/vid_1.mp4",
+        "--realtime",
+        
+        "--init-duration", "10",
+        "--tick-interval", "2",
+        "--move-thresh", "5",
+    ]
+    
+    main_stream(argv=argv)
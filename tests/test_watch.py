@@ -0,0 +1,25 @@
+import os
+import sys
+from pathlib import Path
+
+# for testing, insert package into path to make sure that the local folder is used!
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[1]))
+from calib_move.core.watching import main_watch
+
+if __name__ == "__main__":
+    os.system("cls" if os.name == "nt" else "clear")
+    
+    argv = [
+        # folder that is watched for new videos (copy some videos into it while this is running)
+        "--input-path", "F:/visceral_v1/RecordingA/raw_videos/",
+        "--output_path", "H:/code_bal/VISCERAL_REC_A/",
+        "--plot_name", "test_plot",
+        
+        "--static-window", "START-00:10:00",
+        
+        "--poll-interval", "5",
+        "--stable-polls", "2",
+        "--workers", "2",
+    ]
+    
+    main_watch(argv=argv)
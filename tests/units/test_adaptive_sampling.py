@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+# for testing, insert package into path to make sure that the local folder is used!
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[2]))
+from calib_move.core.containers import CLIArgs, VideoContainer
+from calib_move.core.processing import process_video
+
+# dense uniform grid (the reference) vs. a coarse grid that is bisected down to the spacing of the dense grid
+N_DENSE = 64
+N_COARSE = 8
+THRESH = 2.0 # px
+
+def events(video: VideoContainer) -> list[tuple[float, float]]:
+    # (time [s], size [px]) of every jump between consecutive good steps
+    good = ~np.array(video.errors, dtype=bool)
+    times, moves = np.array(video.timestamps)[good], np.array(video.movements)[good]
+    jumps = np.flatnonzero(np.abs(np.diff(moves)) > THRESH)
+    return [(0.5*(times[i] + times[i+1]), moves[i+1] - moves[i]) for i in jumps]
+
+if __name__ == "__main__":
+    os.system("cls" if os.name == "nt" else "clear")
+
+    # path to a video that should be processed (can be passed as first argument)
+    vid = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("H:/code_elias/random_scrips_balgrist/test_videos/vid_1.mp4")
+
+    # setup some dummy cli args (need the matcher, detector and n_steps)
+    CLIARGS_SYNTH = CLIArgs(
+        input_path="not important here (infos in VideoContainer)",
+        output_path="not important here",
+        static_window="not important here either (infos in VideoContainer)",
+        profile=True,
+    )
+
+    cap = cv.VideoCapture(vid)
+    fpsc, ftot = cap.get(cv.CAP_PROP_FPS), cap.get(cv.CAP_PROP_FRAME_COUNT)
+    H, W = cap.get(cv.CAP_PROP_FRAME_HEIGHT), cap.get(cv.CAP_PROP_FRAME_WIDTH)
+    cap.release()
+
+    resolution = (ftot / fpsc) / N_DENSE # [s] spacing of the dense grid
+    runs = {
+        "uniform": replace(CLIARGS_SYNTH, n_main_steps=N_DENSE),
+        "adaptive": replace(CLIARGS_SYNTH, n_main_steps=N_COARSE, adaptive_thresh=THRESH, adaptive_resolution=resolution),
+    }
+    for name, CLIARGS in runs.items():
+        video = VideoContainer(path=vid, fpsc=fpsc, ftot=ftot, H=H, W=W, static_window=(0, 10)) # seconds
+
+        t0 = time.perf_counter()
+        process_video(CLIARGS, video)
+        t1 = time.perf_counter()
+
+        print(f"{name:>8}: {len(video.movements):3d} steps, {video.profile['detect'][0]:4d} detections, {t1-t0:6.2f} s")
+        for tm, size in events(video):
+            print(f"          event at {tm:8.2f} s ({size:+.2f} px)")
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+# for testing, insert package into path to make sure that the local folder is used!
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[2]))
+from calib_move.core.containers import CLIArgs, VideoContainer
+from calib_move.core.processing import process_video
+
+# keypoint budgets to compare (None = all keypoints, the reference for the accuracy)
+BUDGETS = [None, 8000, 4000, 2000, 1000, 500]
+
+if __name__ == "__main__":
+    os.system("cls" if os.name == "nt" else "clear")
+
+    # path to a video that should be processed (can be passed as first argument)
+    vid = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("H:/code_elias/random_scrips_balgrist/test_videos/vid_1.mp4")
+
+    # setup some dummy cli args (need the matcher, detector and n_steps)
+    CLIARGS_SYNTH = CLIArgs(
+        input_path="not important here (infos in VideoContainer)",
+        output_path="not important here",
+        static_window="not important here either (infos in VideoContainer)"
+    )
+
+    cap = cv.VideoCapture(vid)
+    fpsc, ftot = cap.get(cv.CAP_PROP_FPS), cap.get(cv.CAP_PROP_FRAME_COUNT)
+    H, W = cap.get(cv.CAP_PROP_FRAME_HEIGHT), cap.get(cv.CAP_PROP_FRAME_WIDTH)
+    cap.release()
+
+    # process the same video with every budget: speed vs. deviation from the unlimited result
+    reference = None
+    print(f"{'budget':>8} | {'time [s]':>8} | {'mean dev [px]':>13} | {'max dev [px]':>12} | {'errors':>6}")
+    for budget in BUDGETS:
+        video = VideoContainer(path=vid, fpsc=fpsc, ftot=ftot, H=H, W=W, static_window=(0, 10)) # seconds
+
+        t0 = time.perf_counter()
+        process_video(replace(CLIARGS_SYNTH, max_keypoints=budget), video)
+        t1 = time.perf_counter()
+
+        movements = np.array(video.movements)
+        if reference is None:
+            reference = movements
+        dev = np.abs(movements - reference)
+        print(f"{str(budget):>8} | {t1-t0:8.2f} | {dev.mean():13.3f} | {dev.max():12.3f} | {sum(video.errors):6d}")
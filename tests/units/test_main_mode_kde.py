@@ -0,0 +1,32 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# for testing, insert package into path to make sure that the local folder is used!
+sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[2]))
+from calib_move.util.util import main_mode_kde, main_mode_kde_batched
+
+if __name__ == "__main__":
+    os.system("cls" if os.name == "nt" else "clear")
+    
+    # synthetic main steps: 3 of 5 sub-frames agree on a movement, 2 are outliers. some steps have missing sub-frames
+    rng = np.random.default_rng(0)
+    n_steps = 5000
+    data = np.concatenate([rng.normal(5, 1.5, (n_steps, 3)), rng.uniform(0, 40, (n_steps, 2))], axis=1)
+    data[::10, 4] = np.nan
+    
+    t0 = time.perf_counter()
+    scalar = np.array([main_mode_kde(dt[np.isfinite(dt)], bandwidth=2.0) for dt in data])
+    t1 = time.perf_counter()
+    modes, agreements = main_mode_kde_batched(data, bandwidth=2.0)
+    t2 = time.perf_counter()
+    
+    # equally high peaks can be resolved differently, so the modes are only compared for clearly agreeing steps
+    agree = scalar[:, 1] >= 0.3
+    print(f"scalar:  {t1-t0:.3f} s")
+    print(f"batched: {t2-t1:.3f} s")
+    print(f"max mode deviation (agreement >= 0.3): {np.abs(scalar[agree, 0] - modes[agree]).max():.4f}")
+    print(f"max agreement deviation:               {np.abs(scalar[:, 1] - agreements).max():.2e}")
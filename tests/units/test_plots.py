@@ -1,5 +1,6 @@
 import os
 import sys
+from dataclasses import replace
 from pathlib import Path
 
 import cv2 as cv
@@ -8,7 +9,7 @@ import numpy as np
 
 # for testing, insert package into path to make sure that the local folder is used!
 sys.path.insert(0, os.path.normcase(Path(__file__).resolve().parents[2]))
-from calib_move.config.coreconfig import ROOT
+from calib_move.config.coreconfig import ROOT, PlotBackend
 from calib_move.config.plotconfig import PlotConfig
 from calib_move.core.containers import CLIArgs, VideoContainer
 from calib_move.core.plotting import plot_video
@@ -55,13 +56,15 @@ if __name__ == "__main__":
     # plotly customization params
     PCFG = PlotConfig
     
-    # create the plot and save it (note this returns a png of the plot and not the plotly figure)
+    # create the plot with both backends and save it (note this returns a png of the plot and not the plotly figure)
     [fig_png] = plot_video(CLIARGS_SYNTH, PCFG, video)
+    [fig_raster] = plot_video(replace(CLIARGS_SYNTH, plot_backend=PlotBackend.RASTER), PCFG, video)
     
     cv.imwrite(ROOT/PLOT_OUTPUT_DIR/"plot_test.png", fig_png)
+    cv.imwrite(ROOT/PLOT_OUTPUT_DIR/"plot_test_raster.png", fig_raster)
     
     # also show in window for debugging
-    plt.imshow(fig_png[:, :, [2, 1, 0]]) # need to invert rgb because of cv2
+    plt.imshow(np.concatenate([fig_png, fig_raster], axis=0)[:, :, [2, 1, 0]]) # need to invert rgb because of cv2
     plt.show()
     
     print("done")